@@ -0,0 +1,191 @@
+#
+# benchmark.py
+#
+# Times the trim engine on synthetic media generated with ffmpeg, so changes can be measured against a baseline on the same machine
+#
+# Usage: python -m benchmark [--output results.json] [--baseline previous.json] [--repeat N] [--durations 10 60] [--gops 1 10] [--quick]
+#
+# Fixtures are generated once from lavfi sources and kept in the cache folder, every combination of:
+#   durations (s), GOP lengths (s) and audio layouts (none, a silent alternate track, a loud alternate track)
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import cache
+from cache import CREATION_FLAGS
+import logic
+import profiles
+import keyframes as keyframeIndex
+
+FIXTURE_SIZE = "1280x720"
+FIXTURE_RATE = 30
+AUDIO_LAYOUTS = ["none", "silent", "loud"]     # no audio, or a main track plus a silent or loud alternate track
+CLIP_DURATION = 10                              # seconds trimmed from the middle of each fixture
+
+DEFAULT_DURATIONS = [10, 60]
+DEFAULT_GOPS = [1, 10]
+
+
+def getFixturePath(duration: int, gop: int, audioLayout: str):
+    """
+        Returns the path of the fixture, generating it first if it is not in the cache
+    """
+    name = f"{duration}s-gop{gop}-{audioLayout}.mp4"
+    path = os.path.join(cache.getCacheDir("benchmark"), name)
+    if os.path.exists(path): return path
+
+    command = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size={FIXTURE_SIZE}:rate={FIXTURE_RATE}:duration={duration}']
+    maps = ['-map', '0:v']
+    if audioLayout != "none":
+        alternate = 'anullsrc=r=48000:cl=mono' if audioLayout == "silent" else 'sine=frequency=880:sample_rate=48000'
+        command += ['-t', str(duration), '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000']
+        command += ['-t', str(duration), '-f', 'lavfi', '-i', alternate]
+        maps += ['-map', '1:a', '-map', '2:a']
+    command += maps + [
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+        '-g', str(gop * FIXTURE_RATE), '-keyint_min', str(gop * FIXTURE_RATE), '-sc_threshold', '0',     # fixed GOP length
+        '-c:a', 'aac',
+        f"{path}.tmp.mp4"
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+    if result.returncode != 0:
+        raise Exception(f"Could not generate fixture {name}: {result.stderr.strip()}")
+    os.replace(f"{path}.tmp.mp4", path)
+    return path
+
+def getMachineInfo():
+    """
+        Returns a dict describing the machine and ffmpeg build, results are only comparable between equal machines
+    """
+    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+    return dict(
+        platform=platform.platform(),
+        processor=platform.processor(),
+        cpuCount=multiprocessing.cpu_count(),
+        python=platform.python_version(),
+        ffmpeg=result.stdout.split("\n")[0] if result.returncode == 0 else None
+    )
+
+def runBenchmarks(durations: list, gops: list, audioLayouts: list, repeat: int, encoderProfile: str, onResult = None):
+    """
+        Times each engine operation on every fixture, repeat times. Every operation is called with an output path it may write to.
+        Returns a list of dicts of fixture, benchmark, seconds (every run), min and median.
+        onResult is called with each result as it finishes
+    """
+    results = []
+    logic.threadBudget.setConcurrency(1)        # one job at a time, as a single clip trims
+
+    for duration in durations:
+        for gop in gops:
+            for audioLayout in audioLayouts:
+                inputPath = getFixturePath(duration, gop, audioLayout)
+                fixture = os.path.basename(inputPath)
+                clipDuration = min(CLIP_DURATION, duration / 2)
+                startTime = (duration - clipDuration) / 2
+                endTime = startTime + clipDuration
+                fullVideoLength = duration * 1000
+
+                benchmarks = [
+                    ("keyframeIndex", lambda outputPath: keyframeIndex._buildIndex(inputPath)),
+                    ("keyframeSearch", lambda outputPath: logic._searchKeyframes(inputPath, startTime, endTime, fullVideoLength)),
+                    ("trimCopy", lambda outputPath: logic.trimVideo(inputPath, outputPath, startTime, endTime, False, fullVideoLength)),
+                    ("trimFramePerfect", lambda outputPath: logic.trimVideo(inputPath, outputPath, startTime, endTime, True, fullVideoLength, encoderProfile=encoderProfile)),
+                    ("trimSmartRender", lambda outputPath: logic.trimVideo(inputPath, outputPath, startTime, endTime, True, fullVideoLength, isSmartRender=True, encoderProfile=encoderProfile)),
+                ]
+                if audioLayout != "none":
+                    benchmarks.append(("checkIsSilent", lambda outputPath: logic.checkIsSilent(inputPath, startTime, endTime)))
+
+                keyframeIndex.getKeyframes(inputPath)       # copies read the index, it is built before they are timed
+                for name, function in benchmarks:
+                    seconds = [_timeRun(function) for _ in range(repeat)]
+                    result = dict(fixture=fixture, benchmark=name, seconds=seconds, min=min(seconds), median=statistics.median(seconds))
+                    results.append(result)
+                    if onResult != None: onResult(result)
+
+    return results
+
+def _timeRun(function):
+    """
+        Returns the seconds taken by the function, given an output path in a temporary folder removed after the run
+    """
+    with tempfile.TemporaryDirectory() as tempDir:
+        outputPath = os.path.join(tempDir, "output.mp4")
+        start = time.perf_counter()
+        function(outputPath)
+        return time.perf_counter() - start
+
+def compareResults(results: list, baseline: dict):
+    """
+        Returns a list of (fixture, benchmark, baseline median, median, ratio) for every result also in the baseline
+    """
+    baselineMedians = dict(((result["fixture"], result["benchmark"]), result["median"]) for result in baseline["results"])
+    comparisons = []
+    for result in results:
+        previous = baselineMedians.get((result["fixture"], result["benchmark"]))
+        if previous == None: continue
+        comparisons.append((result["fixture"], result["benchmark"], previous, result["median"], result["median"] / previous if previous > 0 else None))
+    return comparisons
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog="benchmark", description="Times the trim engine on synthetic fixtures and writes the results as JSON")
+    parser.add_argument("--output", default="benchmark.json", help="path of the JSON results (default benchmark.json)")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark, the median is compared (default 3)")
+    parser.add_argument("--durations", type=int, nargs="+", default=DEFAULT_DURATIONS, help="fixture durations in seconds")
+    parser.add_argument("--gops", type=int, nargs="+", default=DEFAULT_GOPS, help="fixture GOP lengths in seconds")
+    parser.add_argument("--audio", choices=AUDIO_LAYOUTS, nargs="+", default=AUDIO_LAYOUTS, help="fixture audio layouts")
+    parser.add_argument("--profile", choices=list(profiles.ENCODER_PROFILES.keys()), default="Fast", help="encoder profile of frame perfect trims (default Fast)")
+    parser.add_argument("--quick", action="store_true", help="only the shortest duration and GOP, run once")
+    args = parser.parse_args(args)
+
+    if args.quick:
+        args.durations, args.gops, args.repeat = [min(args.durations)], [min(args.gops)], 1
+
+    baseline = None
+    if args.baseline != None:
+        try:
+            with open(args.baseline, encoding="utf-8") as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Could not read baseline: {e}", file=sys.stderr)
+            return 2
+
+    print(f"{'Fixture':<24}{'Benchmark':<20}{'Median (s)':>12}{'Min (s)':>10}")
+    def printResult(result):
+        print(f"{result['fixture']:<24}{result['benchmark']:<20}{result['median']:>12.3f}{result['min']:>10.3f}")
+    try:
+        results = runBenchmarks(args.durations, args.gops, args.audio, max(1, args.repeat), args.profile, onResult=printResult)
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+
+    settings = dict(durations=args.durations, gops=args.gops, audio=args.audio, repeat=args.repeat, profile=args.profile, size=FIXTURE_SIZE, rate=FIXTURE_RATE)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(dict(time=time.time(), machine=getMachineInfo(), settings=settings, results=results), file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if baseline != None:
+        if baseline.get("machine") != getMachineInfo():
+            print("The baseline was recorded on a different machine or ffmpeg build, timings may not be comparable")
+        print(f"\n{'Fixture':<24}{'Benchmark':<20}{'Baseline (s)':>14}{'Median (s)':>12}{'Change':>10}")
+        for fixture, benchmark, previous, median, ratio in compareResults(results, baseline):
+            change = f"{(ratio - 1) * 100:+.1f}%" if ratio != None else "-"
+            print(f"{fixture:<24}{benchmark:<20}{previous:>14.3f}{median:>12.3f}{change:>10}")
+
+    return 0
+
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+#
+# cache.py
+#
+# Contains helpers for the persistent caches kept on disk for each input file
+#
+
+import os
+import hashlib
+import subprocess
+
+# hide the console window of child processes on windows, shared by every module that runs ffmpeg
+CREATION_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+
+def getCacheDir(name: str):
+    """
+        Returns the path to the named cache folder, creating it if needed
+    """
+    basePath = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(basePath, "Bulk Video Trimmer", name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def getFileKey(inputPath: str):
+    """
+        Returns a key unique to the path, size and modification time of the file.
+        Any change to the file results in a new key, so stale cache entries are never read
+    """
+    stat = os.stat(inputPath)
+    identity = f"{os.path.abspath(inputPath)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+def writeFileAtomic(path: str, data: bytes):
+    """
+        Writes the data to a temporary file before moving it into place, so that a crash never leaves a partial cache entry
+    """
+    tempPath = f"{path}.{os.getpid()}.tmp"
+    with open(tempPath, "wb") as file:
+        file.write(data)
+    os.replace(tempPath, path)
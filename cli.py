@@ -0,0 +1,177 @@
+#
+# cli.py
+#
+# Runs the trim engine without the GUI from a manifest of clips
+#
+# Usage: python -m cli manifest.json --dest OUTPUT_FOLDER [--workers N] [--label-silent] [--profile NAME] [--resume] [--trace TRACE.json]
+#        python -m cli --calibrate
+#
+# The manifest is a JSON list (or CSV with a header row) of clips with the same fields stored in trimData:
+# description, inputPath, startTime and endTime (ms), isFramePerfect, and optionally
+# fullVideoLength (ms), isSmartRender, encoderProfile and videoNumber
+#
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import logic
+import profiles
+import journal
+import probe
+import tracing
+
+REQUIRED_FIELDS = ["description", "inputPath", "startTime", "endTime"]
+
+
+def readManifest(manifestPath: str, defaultProfile: str = profiles.DEFAULT_PROFILE):
+    """
+        Returns the list of trimData read from a JSON or CSV manifest.
+        Clips without an encoderProfile use defaultProfile
+    """
+    with open(manifestPath, newline="", encoding="utf-8") as file:
+        if manifestPath.lower().endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = json.load(file)
+            if isinstance(rows, dict): rows = rows.get("clips", [])
+
+    trimData = []
+    for index, row in enumerate(rows):
+        missing = [field for field in REQUIRED_FIELDS if row.get(field) in [None, ""]]
+        if len(missing) > 0:
+            raise ValueError(f"Clip {index+1} is missing {', '.join(missing)}")
+        if row.get("encoderProfile") and row["encoderProfile"] not in profiles.ENCODER_PROFILES:
+            raise ValueError(f"Clip {index+1} has an unknown encoder profile \"{row['encoderProfile']}\"")
+
+        endTime = float(row["endTime"])
+        trimData.append(dict([
+            ("videoNumber", int(row.get("videoNumber") or index+1)),
+            ("description", str(row["description"])),
+            ("startTime", float(row["startTime"])),
+            ("endTime", endTime),
+            ("fullVideoLength", float(row.get("fullVideoLength") or endTime)),     # only needed if no keyframe follows the clip
+            ("isFramePerfect", _parseBool(row.get("isFramePerfect"))),
+            ("isSmartRender", _parseBool(row.get("isSmartRender"))),
+            ("encoderProfile", row.get("encoderProfile") or defaultProfile),
+            ("inputPath", str(row["inputPath"]))
+        ]))
+
+    return trimData
+
+def _parseBool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ["1", "true", "yes", "y"]
+    return bool(value)
+
+def runBatch(trimData: list, destFolder: str, maxWorkers: int, labelSilentClips: bool, resume: bool = False):
+    """
+        Trims every clip into destFolder and prints the result of each.
+        If resume is set and the journal in destFolder is of the same manifest, clips it lists as finished are skipped.
+        Returns the number of failed clips
+    """
+    trimJournal = journal.TrimJournal(destFolder)
+    finishedJobs = set()
+    orders = dict()
+    session = journal.readJournal(destFolder) if resume else None
+    if session != None and session["clips"] == trimData and not session["isFinished"]:
+        finishedJobs = journal.getFinishedJobs(session)
+        orders = session["orders"]
+        print(f"Resuming, {len(finishedJobs)} of {len(trimData)} clips already finished")
+    else:
+        if resume: print("No unfinished session of this manifest to resume, starting over")
+        trimJournal.start(sorted(set(clip["inputPath"] for clip in trimData)))
+        for clip in trimData:
+            trimJournal.addClip(clip)
+        trimJournal.setTrimming(dict(TrimWorkers=maxWorkers, LabelSilentClips=labelSilentClips))
+
+    # probe every input once, clips of files that cannot be trimmed fail before any work starts
+    inputPaths = sorted(set(clip["inputPath"] for clip in trimData))
+    infos = dict((path, future.result()) for path, future in zip(inputPaths, probe.prefetchMediaInfo(inputPaths, maxWorkers=maxWorkers)))
+
+    failed = 0
+    pool = logic.TrimPool(maxWorkers)
+    outputNumbers = logic.getOutputNumbers(destFolder)
+    jobs = []
+    for jobId, clip in enumerate(trimData):
+        if jobId in finishedJobs: continue
+        if infos[clip["inputPath"]]["error"] != None:
+            failed += 1
+            print(f"[ERROR] Trimming \"{clip['description']}\" failed: {infos[clip['inputPath']]['error']}", file=sys.stderr)
+            continue
+        if jobId not in orders:
+            orders[jobId] = outputNumbers.reserve()      # outputs do not exist yet, so reserve the number
+        else:
+            logic.removeUnfinishedOutput(destFolder, clip, orders[jobId])     # left by the interrupted run
+        jobs.append((jobId, clip, orders[jobId]))
+
+    logic.submitTrimJobs(pool, jobs, destFolder, labelSilentClips, trimJournal=trimJournal)
+
+    while not pool.isDone():
+        for jobIds, isSuccess, value in pool.getResults():
+            for index, jobId in enumerate(jobIds):
+                if isSuccess:
+                    print(f"Finished \"{os.path.basename(value[index])}\"")
+                else:
+                    failed += 1
+                    print(f"[ERROR] Trimming \"{trimData[jobId]['description']}\" failed: {value}", file=sys.stderr)
+        time.sleep(.05)
+    pool.shutdown()
+    probe.shutdownPrefetch()
+
+    if failed == 0: trimJournal.finish()
+    return failed
+
+def printCalibration():
+    """
+        Benchmarks every x264 preset on this machine and prints the encode speed against output size
+    """
+    print(f"{'Preset':<12}{'fps':>10}{'Size (KB)':>12}{'Time (s)':>10}")
+    for result in profiles.calibratePresets():
+        print(f"{result['preset']:<12}{result['fps']:>10.1f}{result['bytes'] / 1024:>12.0f}{result['seconds']:>10.2f}")
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog="cli", description="Trims every clip listed in a JSON or CSV manifest without the GUI")
+    parser.add_argument("manifest", nargs="?", help="path to a .json or .csv manifest of clips")
+    parser.add_argument("--dest", help="destination folder of the trimmed clips")
+    parser.add_argument("--workers", type=int, default=4, help="number of clips trimmed at once (default 4)")
+    parser.add_argument("--label-silent", action="store_true", help="prefix clips with a silent alternate audio track with (no sound)")
+    parser.add_argument("--profile", choices=list(profiles.ENCODER_PROFILES.keys()), default=profiles.DEFAULT_PROFILE, help="encoder profile of frame perfect clips that do not set one")
+    parser.add_argument("--resume", action="store_true", help="skip clips finished by an interrupted run of the same manifest into --dest")
+    parser.add_argument("--trace", help="write a timeline of every trim stage to this path as Chrome trace-event JSON")
+    parser.add_argument("--calibrate", action="store_true", help="benchmark each encoder preset on this machine and exit")
+    args = parser.parse_args(args)
+
+    if args.calibrate:
+        printCalibration()
+        return 0
+    if args.manifest == None or args.dest == None:
+        parser.error("a manifest and --dest are required")
+
+    try:
+        trimData = readManifest(args.manifest, defaultProfile=args.profile)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Could not read manifest: {e}", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.dest, exist_ok=True)
+
+    startTime = time.time()
+    if args.trace != None: tracing.start()
+    with tracing.span("batch", clips=len(trimData), workers=args.workers):
+        failed = runBatch(trimData, args.dest, args.workers, args.label_silent, resume=args.resume)
+    if args.trace != None:
+        print(f"Trace of {tracing.stop(args.trace)} spans written to {args.trace}")
+
+    print(f"Trimmed {len(trimData) - failed} of {len(trimData)} clips in {round(time.time() - startTime, 1)}s, {failed} failed")
+    return 1 if failed > 0 else 0
+
+
+
+#
+# Main
+#
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+#
+# frames.py
+#
+# Contains the ring buffer of decoded frames used to step through a paused video without seeking the player
+#
+
+import re
+import queue
+import subprocess
+import threading
+import numpy as np
+from cache import CREATION_FLAGS
+
+FRAME_CAPACITY = 64             # frames kept, half before and half after the playhead
+MAX_FRAME_WIDTH = 854           # frames are downscaled to at most this width
+
+PTS_PATTERN = re.compile(r"pts_time:\s*(-?[0-9.]+)")
+
+
+class FrameRing():
+    """
+        A fixed number of downscaled RGB frames in presentation order, the oldest is overwritten once it is full
+    """
+    def __init__(self, capacity: int, width: int, height: int):
+        self.capacity = capacity
+        self.width = width
+        self.height = height
+        self.frames = np.zeros((capacity, height, width, 3), dtype=np.uint8)
+        self.times = np.zeros(capacity, dtype=np.float64)      # seconds
+        self.start = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        with self.lock:
+            self.start = 0
+            self.count = 0
+
+    def append(self, frame: np.ndarray, time: float):
+        with self.lock:
+            slot = (self.start + self.count) % self.capacity
+            if self.count == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+            else:
+                self.count += 1
+            self.frames[slot] = frame
+            self.times[slot] = time
+
+    def getTime(self, index: int):
+        """
+            Returns the presentation time (in seconds) of the frame at the index, 0 being the oldest
+        """
+        with self.lock:
+            return float(self.times[(self.start + index) % self.capacity])
+
+    def getFrame(self, index: int):
+        """
+            Returns a copy of the frame at the index as a (height, width, 3) array
+        """
+        with self.lock:
+            return self.frames[(self.start + index) % self.capacity].copy()
+
+    def find(self, time: float, frameDuration: float):
+        """
+            Returns the index of the frame shown at the time (in seconds), or None if the time is outside of the buffered frames
+        """
+        with self.lock:
+            if self.count == 0: return None
+            times = self.times[(self.start + np.arange(self.count)) % self.capacity]
+        index = int(np.searchsorted(times, time + frameDuration / 2, side="right")) - 1
+        if index < 0 or time > times[-1] + frameDuration: return None
+        return index
+
+
+
+class FrameDecoder():
+    """
+        Decodes the frames around a time into a ring on a background thread.
+        Starting a new window stops the one being decoded
+    """
+    def __init__(self):
+        self.ring = None
+        self.inputPath = None
+        self.startTime = 0
+        self.endTime = 0
+        self.generation = 0
+        self.isDecoding = False
+        self.process = None
+        self.lock = threading.Lock()
+
+    def getRing(self, inputPath: str):
+        """
+            Returns the ring of the file, or None if the frames are of another file
+        """
+        return self.ring if self.inputPath == inputPath else None
+
+    def isCovering(self, inputPath: str, time: float):
+        """
+            Returns True if the window being decoded or already decoded includes the time (in seconds)
+        """
+        return self.inputPath == inputPath and self.startTime <= time <= self.endTime
+
+    def decode(self, inputPath: str, time: float, fps: float, width: int, height: int):
+        """
+            Starts decoding FRAME_CAPACITY frames centered on the time (in seconds), scaled to width x height
+        """
+        self.stop()
+        if self.ring == None or self.ring.width != width or self.ring.height != height:
+            self.ring = FrameRing(FRAME_CAPACITY, width, height)
+        self.ring.clear()
+
+        self.inputPath = inputPath
+        self.startTime = max(0, time - FRAME_CAPACITY / 2 / fps)
+        self.endTime = self.startTime + FRAME_CAPACITY / fps
+        with self.lock:
+            self.generation += 1
+            self.isDecoding = True
+        threading.Thread(target=self._decode, args=(self.generation, self.ring, inputPath, self.startTime), daemon=True).start()
+
+    def stop(self):
+        """
+            Stops decoding, the frames already decoded are kept
+        """
+        with self.lock:
+            self.generation += 1
+            self.isDecoding = False
+            if self.process != None and self.process.poll() == None:
+                self.process.kill()
+
+    def reset(self):
+        """
+            Stops decoding and forgets the decoded frames
+        """
+        self.stop()
+        self.inputPath = None
+        if self.ring != None: self.ring.clear()
+
+    def _decode(self, generation: int, ring: FrameRing, inputPath: str, startTime: float):
+        """
+            Reads raw frames from ffmpeg, pairing each with the timestamp printed by the showinfo filter.
+            The input is seeked to startTime, so timestamps are relative to it
+        """
+        command = [
+            'ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'info',
+            '-ss', str(startTime),
+            '-i', str(inputPath),
+            '-map', '0:v:0', '-an', '-sn',
+            '-vf', f'scale={ring.width}:{ring.height},showinfo',
+            '-vsync', 'passthrough',            # keep every frame once, as it was decoded
+            '-frames:v', str(ring.capacity),
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-threads', '2',
+            '-'
+        ]
+        with self.lock:
+            if generation != self.generation: return
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATION_FLAGS)
+            self.process = process
+
+        # showinfo logs each frame before it is written to stdout
+        times = queue.Queue()
+        def readTimes():
+            for line in process.stderr:
+                match = PTS_PATTERN.search(line.decode("utf-8", errors="replace"))
+                if match != None: times.put(float(match.group(1)))
+        threading.Thread(target=readTimes, daemon=True).start()
+
+        frameSize = ring.width * ring.height * 3
+        try:
+            while generation == self.generation:
+                data = process.stdout.read(frameSize)
+                if len(data) < frameSize: break
+                try:
+                    time = times.get(timeout=5)
+                except queue.Empty:
+                    break
+                if generation != self.generation: break
+                ring.append(np.frombuffer(data, dtype=np.uint8).reshape(ring.height, ring.width, 3), startTime + time)
+        finally:
+            if process.poll() == None: process.kill()
+            process.stdout.close()
+            process.wait()
+            with self.lock:
+                if generation == self.generation:
+                    self.isDecoding = False
+                    self.process = None
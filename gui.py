@@ -14,12 +14,23 @@ from PIL import Image, ImageTk
 from pathvalidate import sanitize_filepath
 from tkinter import ttk
 import logic
+import profiles
 from tkinter import font
 import os
 from tkinter import messagebox
 import sys
+import time
+import queue
+import threading
+import cache
+import journal
+import probe
+import tracing
+import proxies
+import keyframes as keyframeIndex
 
 bg = "#eeeeee"
+LOG_LIMIT = 20          # trim logs kept in the cache folder, the oldest are removed
 
 class Scene(Enum):
     SCENE_INITIAL = 0
@@ -41,6 +52,26 @@ def getResourcePath(relativePath: str):
 
     return os.path.join(basePath, relativePath)
 
+def formatDuration(seconds: float):
+    """
+        Returns the duration as h:mm:ss, or m:ss if under an hour
+    """
+    seconds = int(seconds)
+    h, m, s = seconds // 3600, (seconds % 3600) // 60, seconds % 60
+    return f"{h}:{m:02}:{s:02}" if h > 0 else f"{m}:{s:02}"
+
+def pruneLogs(directory: str):
+    """
+        Removes the oldest trim logs in the folder until at most LOG_LIMIT are left
+    """
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("trim-") and name.endswith(".log")]
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:max(0, len(paths) - LOG_LIMIT)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass        # still open by another instance, it is removed next time
+
 class MainApp(tk.Frame):
     """
         The main gui application
@@ -63,6 +94,10 @@ class MainApp(tk.Frame):
         self.videoPaths = None
         self.destFolder = None
         self.trimData = []
+        self.journal = None
+        self.startVideo = 1             # video shown first by the clip scene
+        self.resumedJobs = set()        # clips finished before a resumed session
+        self.resumedOrders = dict()     # output numbers reserved before a resumed session
 
     def updateDiscordPresence(self, presence):
         try:
@@ -90,6 +125,10 @@ class MainApp(tk.Frame):
             self.videoPaths = None
             self.destFolder = None
             self.trimData = []
+            self.journal = None
+            self.startVideo = 1
+            self.resumedJobs = set()
+            self.resumedOrders = dict()
 
             self.unbindAll()
 
@@ -109,6 +148,10 @@ class MainApp(tk.Frame):
                 self.videoPaths = ('test.mp4','test2.mp4','test3.mp4','nosound.mp4','nosound2.mp4')
                 self.destFolder = "TestOutput"
 
+            if self.journal == None:
+                self.journal = journal.TrimJournal(self.destFolder)
+                self.journal.start(self.videoPaths)
+
             self.scene = ClipScene(self, self.root, self.videoPaths, self.destFolder, discordPresence=self.discordPresence, mainApp=self, optionStates=self.savedOptions)
             self.root.minsize(495,387)
             self.root.resizable(True, True)
@@ -118,6 +161,8 @@ class MainApp(tk.Frame):
 
             if type(self.scene) == ClipScene:
                 self.savedOptions = self.scene.options 
+            if self.journal != None:
+                self.journal.setTrimming(self.getOptionValues())
                 
             self.scene = TrimScene(self, mainApp=self, options=self.savedOptions)
             self.root.minsize(400,260)
@@ -131,6 +176,41 @@ class MainApp(tk.Frame):
                     self.discordPresence = None     # discord was likely closed
                 
 
+    def resumeSession(self, session: dict):
+        """
+            Restores an interrupted session read from the journal in the destination folder
+        """
+        self.videoPaths = tuple(session["videoPaths"])
+        self.trimData = session["clips"]
+        self.startVideo = min(session["currentVideo"], len(self.videoPaths))
+        self.resumedJobs = journal.getFinishedJobs(session)
+        self.resumedOrders = session["orders"]
+        if len(session["options"]) > 0:
+            self.savedOptions = self.getOptionVariables(session["options"])     # options the batch was started with
+        self.journal = journal.TrimJournal(self.destFolder)     # keep appending to the same journal
+        probe.prefetchMediaInfo(self.videoPaths)
+
+        self.setScene(Scene.SCENE_TRIM if session["isTrimming"] else Scene.SCENE_CLIPS)
+
+    def getOptionValues(self):
+        """
+            Returns the current value of each saved option, or None if no options were set
+        """
+        if self.savedOptions == None: return None
+        return dict((name, variable.get()) for name, variable in self.savedOptions.items())
+
+    def getOptionVariables(self, values: dict):
+        """
+            Returns option variables holding the values recorded by getOptionValues.
+            Options that were not recorded are created with their defaults by the clip scene
+        """
+        options = dict()
+        for name, value in values.items():
+            if isinstance(value, bool): options[name] = tk.BooleanVar(value=value)
+            elif isinstance(value, int): options[name] = tk.IntVar(value=value)
+            else: options[name] = tk.StringVar(value=str(value))
+        return options
+
     def getSceneType(self):
         if type(self.scene) == InitialScene:
             return Scene.SCENE_INITIAL
@@ -283,7 +363,57 @@ class BeginButton(tk.Frame):
         self.bBegin.pack(fill="both", expand=True)
 
     def bBegin_onClick(self):
-        self.parent.parent.setScene(Scene.SCENE_CLIPS)
+        mainApp = self.parent.parent
+
+        # offer to resume an interrupted session in the destination folder
+        session = journal.getResumableSession(mainApp.destFolder)
+        if session != None:
+            finished = len(journal.getFinishedJobs(session))
+            result = messagebox.askyesnocancel("Resume trimming", f"An unfinished session of {len(session['clips'])} clip{'s' if len(session['clips']) != 1 else ''} from {len(session['videoPaths'])} video{'s' if len(session['videoPaths']) != 1 else ''} ({finished} finished) was found in the destination folder.\n\nResume it? Choosing No starts over with the selected videos.")
+            if result == None: return
+            if result == True:
+                mainApp.resumeSession(session)
+                return
+
+        # probe every file before clipping starts
+        if not self.checkFiles(): return
+
+        mainApp.setScene(Scene.SCENE_CLIPS)
+
+    def checkFiles(self):
+        """
+            Probes the selected videos in parallel and prompts to remove any that cannot be trimmed.
+            Returns False if clipping should not start
+        """
+        mainApp = self.parent.parent
+        futures = probe.prefetchMediaInfo(mainApp.videoPaths)
+
+        self.setEnabled(False)
+        while not all(future.done() for future in futures):
+            self.bBegin.config(text=f"Checking files ({sum(future.done() for future in futures)}/{len(futures)})")
+            self.parent.update()
+            time.sleep(.01)
+        self.bBegin.config(text="Gather Files")
+        self.setEnabled(True)
+
+        badFiles = []
+        for path, future in zip(mainApp.videoPaths, futures):
+            error = future.result()["error"]
+            if error != None: badFiles.append((path, error))
+        if len(badFiles) == 0: return True
+
+        details = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in badFiles[:10])
+        if len(badFiles) > 10: details += f"\n...and {len(badFiles) - 10} more"
+        if len(badFiles) == len(mainApp.videoPaths):
+            messagebox.showerror("Unsupported files", f"None of the selected videos can be trimmed.\n\n{details}")
+            return False
+
+        result = messagebox.askokcancel("Unsupported files", f"{len(badFiles)} of the selected videos cannot be trimmed and will be skipped.\n\n{details}")
+        if result != True: return False
+
+        badPaths = set(path for path, _ in badFiles)
+        mainApp.videoPaths = tuple(path for path in mainApp.videoPaths if path not in badPaths)
+        return True
 
     def setEnabled(self, value: bool):
         self.bBegin.config(state="active" if value else "disabled")
@@ -300,7 +430,7 @@ class ClipScene(tk.Frame):
         self.grid_columnconfigure(0, weight=1)
         self.parent = parent
         self.root = root
-        self.currentVideo = 1
+        self.currentVideo = mainApp.startVideo if mainApp != None else 1
         self.totalVideos = len(videoPaths)
         self.discordPresence = discordPresence
 
@@ -324,7 +454,9 @@ class ClipScene(tk.Frame):
             self.options["AltTrack"] = cbox_AltTrack
         def onClick_AltTrack():
             isEnabled = cbox_AltTrack.get()
-            if self.video.player.audio_get_track_count() >= 3:
+            info = probe.getCachedMediaInfo(videoPaths[self.currentVideo-1])
+            trackCount = info["audioTracks"] + 1 if info != None else self.video.player.audio_get_track_count()     # vlc counts disabled audio as a track
+            if trackCount >= 3:
                 self.video.player.audio_set_track(2 if isEnabled else 1) 
                 
         self.optionMenu.add_checkbutton(label="Alternate audio track", variable=cbox_AltTrack, command=onClick_AltTrack)
@@ -363,6 +495,29 @@ class ClipScene(tk.Frame):
             elif (isEnabled or len(self.footerBar.descBar.boxContents.get()) > 0) and currState != "normal":
                 self.controlMenu.entryconfigure("Save clip", state='normal')
         self.optionMenu.add_checkbutton(label="Allow unnamed files", variable=cbox_AllowUnnamedFiles, command=onClick_AllowUnnamedFiles)
+        # smart render
+        cbox_SmartRender = self.options.get("SmartRender")
+        if cbox_SmartRender == None:
+            cbox_SmartRender = tk.BooleanVar()
+            self.options["SmartRender"] = cbox_SmartRender
+        self.optionMenu.add_checkbutton(label="Smart render frame perfect trims", variable=cbox_SmartRender)
+        # snap to keyframes
+        cbox_SnapToKeyframes = self.options.get("SnapToKeyframes")
+        if cbox_SnapToKeyframes == None:
+            cbox_SnapToKeyframes = tk.BooleanVar()
+            self.options["SnapToKeyframes"] = cbox_SnapToKeyframes
+        self.optionMenu.add_checkbutton(label="Snap to keyframes", variable=cbox_SnapToKeyframes)
+        # proxy playback
+        cbox_UseProxies = self.options.get("UseProxies")
+        if cbox_UseProxies == None:
+            cbox_UseProxies = tk.BooleanVar()
+            self.options["UseProxies"] = cbox_UseProxies
+        def onClick_UseProxies():
+            isEnabled = cbox_UseProxies.get()
+            self.video.useProxies = isEnabled
+            if isEnabled:
+                proxies.prefetchProxies(videoPaths[self.currentVideo-1:])       # used from the next opened video
+        self.optionMenu.add_checkbutton(label="Play proxies of heavy videos", variable=cbox_UseProxies, command=onClick_UseProxies)
         # change arrow key functionality
         self.optionMenu.add_separator()
         self.seekSpeedMenu = tk.Menu(self.optionMenu, tearoff=0)
@@ -374,6 +529,26 @@ class ClipScene(tk.Frame):
         self.seekSpeedMenu.add_radiobutton(label="5s (default)", variable=selectedSeekSpeed, value=5000)
         self.seekSpeedMenu.add_radiobutton(label="10s", variable=selectedSeekSpeed, value=10000)
         self.optionMenu.add_cascade(label="Set seek time", menu=self.seekSpeedMenu)
+        # concurrent trims
+        self.trimWorkersMenu = tk.Menu(self.optionMenu, tearoff=0)
+        selectedTrimWorkers = self.options.get("TrimWorkers")
+        if selectedTrimWorkers == None:
+            selectedTrimWorkers = tk.IntVar(None, 4)
+            self.options["TrimWorkers"] = selectedTrimWorkers
+        self.trimWorkersMenu.add_radiobutton(label="1", variable=selectedTrimWorkers, value=1)
+        self.trimWorkersMenu.add_radiobutton(label="2", variable=selectedTrimWorkers, value=2)
+        self.trimWorkersMenu.add_radiobutton(label="4 (default)", variable=selectedTrimWorkers, value=4)
+        self.trimWorkersMenu.add_radiobutton(label="8", variable=selectedTrimWorkers, value=8)
+        self.optionMenu.add_cascade(label="Set concurrent trims", menu=self.trimWorkersMenu)
+        # encoder profile of frame perfect trims
+        self.encoderProfileMenu = tk.Menu(self.optionMenu, tearoff=0)
+        selectedEncoderProfile = self.options.get("EncoderProfile")
+        if selectedEncoderProfile == None:
+            selectedEncoderProfile = tk.StringVar(None, profiles.DEFAULT_PROFILE)
+            self.options["EncoderProfile"] = selectedEncoderProfile
+        for name in profiles.ENCODER_PROFILES.keys():
+            self.encoderProfileMenu.add_radiobutton(label=f"{name} (default)" if name == profiles.DEFAULT_PROFILE else name, variable=selectedEncoderProfile, value=name)
+        self.optionMenu.add_cascade(label="Set encoder profile", menu=self.encoderProfileMenu)
         # Label silent clips
         self.optionMenu.add_separator()
         cbox_LabelMutedClips = self.options.get("LabelSilentClips")
@@ -385,6 +560,12 @@ class ClipScene(tk.Frame):
             if isEnabled:
                 messagebox.showinfo("Automatic Labeling", "Automatic labeling of clips requires some extra processing for each clip. This will take some time especially with clips of longer duration.")
         self.optionMenu.add_checkbutton(label="Label silent clips", variable=cbox_LabelMutedClips, command=onClick_LabelSilentClips)
+        # trace of trimming
+        cbox_RecordTrace = self.options.get("RecordTrace")
+        if cbox_RecordTrace == None:
+            cbox_RecordTrace = tk.BooleanVar()
+            self.options["RecordTrace"] = cbox_RecordTrace
+        self.optionMenu.add_checkbutton(label="Record trace of trimming", variable=cbox_RecordTrace)
         
 
 
@@ -419,14 +600,14 @@ class ClipScene(tk.Frame):
         self.controlMenu.add_command(label="Skip", command=self.promptSkip)
         self.controlMenu.add_command(label="Skip all", command=self.promptSkipAll)
         self.controlMenu.add_command(label="Save clip", command=self.saveClip, state="disabled" if not self.options["AllowUnnamedFiles"].get() else "normal")
-        self.controlMenu.add_command(label="Previous video", command=lambda: self.footerBar.nextButton.onClick(skipTrim=True, nextVideo=False, prevVideo=True), state="disabled")
+        self.controlMenu.add_command(label="Previous video", command=lambda: self.footerBar.nextButton.onClick(skipTrim=True, nextVideo=False, prevVideo=True), state="normal" if self.currentVideo > 1 else "disabled")
 
         self.menuBar.add_cascade(label="Menu", menu=self.controlMenu)
         self.menuBar.add_cascade(label="Options", menu=self.optionMenu)
         self.parent.root.config(menu=self.menuBar)
 
         # create video player
-        self.video = video.VideoPlayer(self, root=root, playOnOpen=self.options["Autoplay"].get(), restrictLeftButton=self.actionBar.setLeft, restrictRightButton=self.actionBar.setRight, unrestrictLeftButton=self.actionBar.resetLeft, unrestrictRightButton=self.actionBar.resetRight, clipScene=self, menuBar=self.menuBar, discordPresence=self.discordPresence, mainApp=mainApp)
+        self.video = video.VideoPlayer(self, root=root, playOnOpen=self.options["Autoplay"].get(), useProxies=self.options["UseProxies"].get(), restrictLeftButton=self.actionBar.setLeft, restrictRightButton=self.actionBar.setRight, unrestrictLeftButton=self.actionBar.resetLeft, unrestrictRightButton=self.actionBar.resetRight, clipScene=self, menuBar=self.menuBar, discordPresence=self.discordPresence, mainApp=mainApp)
 
 
         
@@ -458,8 +639,11 @@ class ClipScene(tk.Frame):
 
 
         # setup video
+        if self.options["UseProxies"].get():
+            proxies.prefetchProxies(videoPaths[self.currentVideo-1:])
         self.video.openVideo(videoPaths[self.currentVideo-1])
         self.video.scheduleUpdates()
+        self.preloadNeighbours()
 
         # update text files
         self.tFileCount.config(text=f"{self.currentVideo} of {len(videoPaths)}")
@@ -536,7 +720,7 @@ class ClipScene(tk.Frame):
             self.footerBar.descBar.isBoxFocused = False
             self.root.focus()
 
-        if event.widget == self.video.canvas:
+        if event.widget in [self.video.canvas, self.video.frameView]:       # a stepped frame is drawn over the canvas
             self.video.onClick(event=event)
 
     def onKeyPress(self, event):
@@ -572,6 +756,45 @@ class ClipScene(tk.Frame):
             self.video.player.stop()
             self.parent.setScene(Scene.SCENE_TRIM)
 
+    def preloadNeighbours(self):
+        """
+            Preloads the next and previous videos so moving to either is quick
+        """
+        videoPaths = self.parent.videoPaths
+        neighbours = [self.currentVideo, self.currentVideo-2]       # indexes of the next and previous video
+        self.video.preloadVideos([videoPaths[index] for index in neighbours if 0 <= index < len(videoPaths)])
+
+    def getKeyframes(self):
+        """
+            Returns the keyframe index of the current video, or None if it is not loaded yet
+        """
+        return keyframeIndex.getCachedKeyframes(self.parent.videoPaths[self.currentVideo-1])
+
+    def snapTime(self, time: float, direction: int = 0):
+        """
+            Returns the time (ms) moved to the nearest keyframe if snapping applies to the current clip, otherwise the time unchanged.
+            A direction of 1 or -1 only snaps to keyframes after or before the time
+        """
+        if not self.options["SnapToKeyframes"].get() or self.framePerfectButton.isSet.get() == 1: return time
+        keyframes = self.getKeyframes()
+        if keyframes == None or len(keyframes) == 0: return time
+
+        seconds = time / 1000
+        if direction > 0: keyframe = keyframeIndex.getNextKeyframe(keyframes, seconds)
+        elif direction < 0: keyframe = keyframeIndex.getPreviousKeyframe(keyframes, seconds)
+        else: keyframe = keyframeIndex.getNearestKeyframe(keyframes, seconds)
+        return time if keyframe == None else keyframe * 1000
+
+    def isKeyframeAligned(self, startTime: float, endTime: float):
+        """
+            Returns true if both times (ms) are keyframes or the bounds of the video, so a stream copy needs no keyframe search
+        """
+        keyframes = self.getKeyframes()
+        if keyframes == None or len(keyframes) == 0: return False
+        isStartAligned = startTime <= 0 or keyframeIndex.isKeyframe(keyframes, startTime / 1000)
+        isEndAligned = endTime >= self.video.duration or keyframeIndex.isKeyframe(keyframes, endTime / 1000)
+        return isStartAligned and isEndAligned
+
     def saveClip(self):
         """
             To be used to save the current clip without moving to the next video
@@ -634,13 +857,17 @@ class SetButton(tk.Frame):
         self.button.pack()
 
     def onClick(self):
-        if self.clipScene.video.player.get_position() == 0 and not self.isLeft: return
-        if self.clipScene.video.player.get_time() >= self.clipScene.video.player.get_length()-1000 and self.isLeft: return
+        # the exact time of a stepped to frame, the player may still be seeking to it
+        currentTime = self.clipScene.video.getFrameTime()
+        if currentTime == None: currentTime = self.clipScene.video.player.get_time()
+
+        if currentTime <= 0 and not self.isLeft: return
+        if currentTime >= self.clipScene.video.player.get_length()-1000 and self.isLeft: return
 
         if self.isLeft:
-            self.clipScene.leftTime = self.clipScene.video.player.get_time()
+            self.clipScene.leftTime = self.clipScene.snapTime(currentTime)
         else:
-            self.clipScene.rightTime = self.clipScene.video.player.get_time()
+            self.clipScene.rightTime = self.clipScene.snapTime(currentTime)
 
         self.clipScene.video.restrictPlayback(self.clipScene.leftTime, self.clipScene.rightTime)
 
@@ -665,10 +892,11 @@ class SetButton(tk.Frame):
         elif time < 0 and not self.isLeft and self.clipScene.rightTime + time < 0:
             self.clipScene.rightTime = 0
         else:
+            # when snapping, move to the next keyframe in the direction of the shift
             if self.isLeft:
-                self.clipScene.leftTime += time
+                self.clipScene.leftTime = self.clipScene.snapTime(self.clipScene.leftTime + time, direction=1 if time > 0 else -1)
             else:
-                self.clipScene.rightTime += time
+                self.clipScene.rightTime = self.clipScene.snapTime(self.clipScene.rightTime + time, direction=1 if time > 0 else -1)
 
         self.clipScene.video.restrictPlayback(self.clipScene.leftTime, self.clipScene.rightTime)
 
@@ -734,7 +962,8 @@ class NextButton(tk.Frame):
 
         # save picked times
         if not skipTrim:
-            self.mainApp.trimData.append(dict([("videoNumber", self.clipScene.currentVideo), ("description", san_text), ("startTime", self.clipScene.leftTime), ("endTime", self.clipScene.rightTime), ("fullVideoLength", self.clipScene.video.player.get_length()), ("isFramePerfect", self.clipScene.framePerfectButton.isSet.get() == 1), ("inputPath", self.mainApp.videoPaths[self.clipScene.currentVideo-1])]))
+            self.mainApp.trimData.append(dict([("videoNumber", self.clipScene.currentVideo), ("description", san_text), ("startTime", self.clipScene.leftTime), ("endTime", self.clipScene.rightTime), ("fullVideoLength", self.clipScene.video.duration), ("isFramePerfect", self.clipScene.framePerfectButton.isSet.get() == 1), ("isKeyframeAligned", self.clipScene.isKeyframeAligned(self.clipScene.leftTime, self.clipScene.rightTime)), ("isSmartRender", self.clipScene.options["SmartRender"].get()), ("encoderProfile", self.clipScene.options["EncoderProfile"].get()), ("inputPath", self.mainApp.videoPaths[self.clipScene.currentVideo-1])]))
+            self.mainApp.journal.addClip(self.mainApp.trimData[-1])
 
         if nextVideo or prevVideo:
 
@@ -750,14 +979,18 @@ class NextButton(tk.Frame):
 
                     if lastData["videoNumber"] > self.clipScene.currentVideo:
                         self.mainApp.trimData.pop()
+                        self.mainApp.journal.removeClip()
                     elif lastData["videoNumber"] == self.clipScene.currentVideo:
                         previousData = self.mainApp.trimData.pop()
+                        self.mainApp.journal.removeClip()
                         break
                     else:
                         # passed video, no clip of previous video
                         break
                         
 
+            self.mainApp.journal.setVideo(self.clipScene.currentVideo)
+
             # update previous video button
             self.clipScene.controlMenu.entryconfigure("Previous video", state='normal' if self.clipScene.currentVideo > 1 else 'disabled')
 
@@ -788,13 +1021,16 @@ class NextButton(tk.Frame):
 
                 # update video
                 self.clipScene.video.openVideo(self.mainApp.videoPaths[self.clipScene.currentVideo-1])
+                self.clipScene.preloadNeighbours()
 
                 # if returninto to prevVideo, load previous settings
                 if prevVideo and previousData is not None:
                     self.parent.descBar.boxContents.set(previousData["description"])
-                    self.parent.parent.video.restrictPlayback(previousData["startTime"], previousData["endTime"])
                     self.parent.parent.framePerfectButton.isSet.set(previousData["isFramePerfect"])
-                    self.parent.parent.video._setPlayerPosition(0)
+                    def restorePrevious(video=self.parent.parent.video):
+                        video.restrictPlayback(previousData["startTime"], previousData["endTime"])
+                        video._setPlayerPosition(0)
+                    self.parent.parent.video.whenOpened(restorePrevious)      # the length is only known once it plays
 
                 # reenable text entry
                 self.clipScene.footerBar.descBar.box.config(state="normal")
@@ -947,7 +1183,10 @@ class TrimScene(tk.Frame):
         self.outputHeader = tk.Label(self, text="Output", font=font)
         self.outputHeader.pack(anchor="w")
 
-        self.output = OutputConsole(self)
+        logDir = cache.getCacheDir("logs")
+        logPath = os.path.join(logDir, f"trim-{time.strftime('%Y%m%d-%H%M%S')}.log")
+        self.output = OutputConsole(self, logPath=logPath)
+        pruneLogs(logDir)
         self.output.pack(fill="both", expand=True)
 
         self.buttonFrame = tk.Frame(self)
@@ -968,12 +1207,22 @@ class TrimScene(tk.Frame):
         self.progressBar.pack(side="bottom", pady=0)
 
         # properties
-        self.videoCount = 0
+        self.finishedJobs = set(self.mainApp.resumedJobs)      # completed or skipped clips
+        self.videoCount = len(self.finishedJobs)
+        self.jobOrders = dict(self.mainApp.resumedOrders)     # jobId: output number, kept when a clip is tried again
+        self.failedJobs = []
+        self.batchJobs = set()          # clips queued by the current run
+        self.batchStartTime = 0
+        self.jobProgress = dict()       # jobId: (fraction, fps, speed, time of report), written by worker threads
         self.a = False
 
         # add event bindings
         self.bind("<Configure>", self.onResize)
 
+        self.log(f"Saving log to {logPath}")
+        if len(self.finishedJobs) > 0:
+            self.log(f"Resuming, {len(self.finishedJobs)} clip{'s' if len(self.finishedJobs) != 1 else ''} already finished")
+
     def onResize(self, event):
         """
             Called whenever the window is resized/configured
@@ -984,9 +1233,14 @@ class TrimScene(tk.Frame):
     def skipButtonOnClick(self):
         self.skipButton.grid_forget()   # hide skip button
 
+        # skip the first failed clip, the rest are tried again
+        jobId = self.failedJobs.pop(0)
+        self.finishedJobs.add(jobId)
+        self.mainApp.journal.setState(jobId, journal.STATE_SKIPPED)
+
         # update progress bar
         self.videoCount += 1
-        self.progressBar.bar["value"] = self.videoCount / len(self.mainApp.trimData) * 100
+        self.updateProgress()
         self.progressBar.update()
         self.root.update_idletasks()
 
@@ -1002,67 +1256,99 @@ class TrimScene(tk.Frame):
         self.startButton.config(text="Start", state="disabled")
         self.skipButton.grid_forget()   # hide skip button
 
-        # perform trim on all videos
-        for trimData in self.mainApp.trimData[self.videoCount:]:
-            inputPath = trimData["inputPath"]
-            maxOrder = self.getFileOrder(self.mainApp.destFolder)  
-            startTime = trimData["startTime"] / 1000
-            endTime = trimData["endTime"] / 1000
-            
-
-            # update visual data
-            stringWidth = font.Font().measure(trimData["description"])
-            trimmedText = trimData["description"]
-            self.root.update()
-            trimWidth = self.root.winfo_width()
-            while stringWidth > trimWidth:
-                trimmedText = trimmedText[:-1]
-                stringWidth = font.Font().measure(trimmedText)
-            self.filename.config(text=f"Status: {trimmedText}{'...' if font.Font().measure(trimData['description']) > trimWidth else ''}")
-
-            isSilent = False
-            if self.options != None:
-                if self.options["LabelSilentClips"].get():
-                    self.log(f"Checking for silence in \"{trimData['description']}\"")
-                    isSilent = logic.checkIsSilent(inputPath, startTime, endTime, trimScene=self)     # check if clip is silent
-            outputPath = f"{self.mainApp.destFolder}/({maxOrder}) {'(no sound) ' if isSilent else ''}{trimData['description']}.mp4"
-            isFramePerfect = trimData["isFramePerfect"]
-
+        # get options
+        maxWorkers = 1
+        labelSilentClips = False
+        isTracing = False
+        if self.options != None:
+            maxWorkers = self.options["TrimWorkers"].get() if self.options.get("TrimWorkers") != None else 1
+            labelSilentClips = self.options["LabelSilentClips"].get()
+            isTracing = self.options["RecordTrace"].get() if self.options.get("RecordTrace") != None else False
+        if isTracing: tracing.start()
+
+        # queue every clip that has not been completed or skipped
+        pool = logic.TrimPool(maxWorkers)
+        outputNumbers = logic.getOutputNumbers(self.mainApp.destFolder)
+        jobs = []
+        with tracing.span("queueClips"):
+            for jobId, trimData in enumerate(self.mainApp.trimData):
+                if jobId in self.finishedJobs: continue
+
+                # outputs do not exist yet, so reserve the number
+                if jobId not in self.jobOrders:
+                    self.jobOrders[jobId] = outputNumbers.reserve()
+                else:
+                    logic.removeUnfinishedOutput(self.mainApp.destFolder, trimData, self.jobOrders[jobId])      # left by a failed or interrupted try
+                order = self.jobOrders[jobId]
+
+                startTime = trimData["startTime"] / 1000
+                endTime = trimData["endTime"] / 1000
+                isFramePerfect = trimData["isFramePerfect"]
+                isSmartRender = trimData.get("isSmartRender", False)
+
+                self.log(f"Trimming ({order}) \"{trimData['description']}\" [{round(startTime)} - {round(endTime)}] {('and smart rendering' if isSmartRender else 'and re-encoding') if isFramePerfect else ''}")
+                jobs.append((jobId, trimData, order))
+
+        # reset progress of clips being tried again
+        self.batchJobs = set(jobId for jobId, _, _ in jobs)
+        self.batchStartTime = time.time()
+        for jobId in self.batchJobs:
+            self.jobProgress.pop(jobId, None)
+
+        with tracing.span("batch", clips=len(jobs), workers=maxWorkers):
+            logic.submitTrimJobs(pool, jobs, self.mainApp.destFolder, labelSilentClips, onProgress=self.onJobProgress, trimJournal=self.mainApp.journal)
+
+            clipCount = len(self.mainApp.trimData) - len(self.finishedJobs)
+            self.setStatus(f"Trimming {clipCount} clip{'s' if clipCount != 1 else ''}")
             self.remainder.config(text=f"Remaining: {len(self.mainApp.trimData) - self.videoCount}")
-            self.log(f"Trimming ({maxOrder}) \"{trimData['description']}\" [{round(startTime)} - {round(endTime)}] {'and re-encoding' if isFramePerfect else ''}")
-            self.filename.update()
-            self.remainder.update()
-            self.output.output.update()
-            self.root.update_idletasks()
 
-            isVideoProcessed = False
-            
-            try:
-                logic.trimVideo(inputPath=inputPath, outputPath=outputPath, startTime=startTime, endTime=endTime, isFramePerfect=isFramePerfect, fullVideoLength=trimData['fullVideoLength'], trimScene=self)
-                isVideoProcessed = True
-            except Exception as e:
-                self.log(f"[ERROR] Trimming failed: {e}")
-
-                # delete unprocessed file if needed
-                if os.path.exists(outputPath):
-                    self.log(f"[WARNING] File remains in directory {outputPath}")
-
-            # prompt to try again or skip if not completed
-            if not isVideoProcessed:
-                self.startButton.config(state="normal", text="Try Again")
-                self.skipButton.grid(column=0, row=0)       # display skip button
-                return
+            # wait for jobs, reporting each clip as it finishes
+            self.failedJobs = []
+            lastProgressUpdate = 0
+            while not pool.isDone():
+                for jobIds, isSuccess, value in pool.getResults():
+                    for index, jobId in enumerate(jobIds):
+                        trimData = self.mainApp.trimData[jobId]
+
+                        if isSuccess:
+                            self.finishedJobs.add(jobId)
+                            self.videoCount += 1
+                            self.log(f"Finished \"{os.path.basename(value[index])}\"")
+                        else:
+                            self.failedJobs.append(jobId)
+                            self.log(f"[ERROR] Trimming \"{trimData['description']}\" failed: {value}")
+
+                    # update visual data
+                    self.updateProgress()
+
+                # update running jobs
+                if time.time() - lastProgressUpdate > .25:
+                    self.updateProgress(showRunningJobs=True)
+                    lastProgressUpdate = time.time()
 
+                self.root.update()
+                time.sleep(.01)
+        pool.shutdown()
 
-            # done, update progress bar
-            self.videoCount += 1
-            self.progressBar.bar["value"] = self.videoCount / len(self.mainApp.trimData) * 100
-            self.progressBar.update()
-            self.root.update_idletasks()
+        if isTracing:
+            tracePath = os.path.join(self.mainApp.destFolder, f"trace {time.strftime('%Y-%m-%d %H-%M-%S')}.json")
+            try:
+                self.log(f"Trace of {tracing.stop(tracePath)} spans written to \"{tracePath}\"")
+            except OSError as e:
+                self.log(f"[ERROR] Could not write trace: {e}")
+
+        # prompt to try again or skip if not completed
+        if len(self.failedJobs) > 0:
+            self.failedJobs.sort()
+            self.setStatus(f"Failed \"{self.mainApp.trimData[self.failedJobs[0]]['description']}\"")
+            self.startButton.config(state="normal", text="Try Again")
+            self.skipButton.grid(column=0, row=0)       # display skip button
+            return
 
         # update visual data
         self.filename.config(text="Status: Done")
         self.remainder.config(text="Remaining: 0")
+        self.mainApp.journal.finish()
         self.log("Done.")
 
         # update button to close
@@ -1071,50 +1357,92 @@ class TrimScene(tk.Frame):
         # add reset button
         self.restartButton.grid(column=0, row=0)
 
-    def log(self, message: str):
+    def onJobProgress(self, jobId: int, fraction: float, fps: float, speed: float):
         """
-            Displays the log message to both the console and screen
+            Called from worker threads as ffmpeg reports progress, only stores the values for the next update
         """
-        print(message)      # print to console 
+        self.jobProgress[jobId] = (fraction, fps, speed, time.time())
 
-        # print to gui console
-        self.output.output.configure(state="normal")
-        self.output.output.insert(tk.END, f"{message}\n")        
-        self.output.output.configure(state="disabled")
-        self.output.output.see(tk.END)
-            
-    def getFileOrder(self, directoryPath: str):
+    def updateProgress(self, showRunningJobs: bool = False):
         """
-            Returns the highest file number within the directory path +1.
-            The file number is given by (X) before the filenames
+            Displays the overall progress and the estimated time remaining, weighted by the duration of each clip.
+            Also displays the progress and speed of each running encode if set
         """
-        files = os.listdir(directoryPath)
-        
-        maxOrder = 0
-        for file in files:
-            if len(file) < 3: continue
-            if file[0] != '(': continue
-
-            split = file.split(')')[0]
-            if len(split) == len(file): continue
-            split = split[1:]
-
-            if not split.isnumeric: continue
-            split = float(split)
-            if split != int(split): continue
-            value = int(split)
-            
-            if value > maxOrder: maxOrder = value
+        totalWeight, doneWeight = 0, 0
+        batchWeight, batchDoneWeight = 0, 0
+        for jobId, trimData in enumerate(self.mainApp.trimData):
+            weight = max(.001, (trimData["endTime"] - trimData["startTime"]) / 1000)
+            fraction = 1 if jobId in self.finishedJobs else self.jobProgress.get(jobId, (0,))[0]
+
+            totalWeight += weight
+            doneWeight += weight * fraction
+            if jobId in self.batchJobs:
+                batchWeight += weight
+                batchDoneWeight += weight * fraction
+
+        percent = doneWeight / totalWeight if totalWeight > 0 else 1
+        self.progressBar.bar["value"] = percent * 100
+
+        # estimate from the rate of the current run
+        eta = ""
+        if 0 < batchDoneWeight < batchWeight:
+            elapsed = time.time() - self.batchStartTime
+            eta = f", {formatDuration(elapsed * (batchWeight - batchDoneWeight) / batchDoneWeight)} left"
+        self.remainder.config(text=f"Remaining: {len(self.mainApp.trimData) - self.videoCount} ({round(percent * 100)}%{eta})")
+
+        if not showRunningJobs: return
+
+        # a job with no recent report is likely hung rather than slow
+        runningJobs = []
+        for jobId, (fraction, fps, speed, lastReport) in list(self.jobProgress.items()):
+            if jobId in self.finishedJobs or jobId in self.failedJobs: continue
+
+            text = f"\"{self.mainApp.trimData[jobId]['description']}\" {round(fraction * 100)}% at {round(fps)} fps ({speed:.2f}x)"
+            timeSinceReport = time.time() - lastReport
+            if timeSinceReport > 30:
+                text += f" no progress for {formatDuration(timeSinceReport)}"
+            runningJobs.append(text)
+
+        if len(runningJobs) > 0:
+            self.setStatus(", ".join(runningJobs))
+
+    def setStatus(self, text: str):
+        """
+            Displays the status text, shortened to fit the window
+        """
+        stringWidth = font.Font().measure(text)
+        trimmedText = text
+        self.root.update()
+        trimWidth = self.root.winfo_width()
+        while stringWidth > trimWidth:
+            trimmedText = trimmedText[:-1]
+            stringWidth = font.Font().measure(trimmedText)
+        self.filename.config(text=f"Status: {trimmedText}{'...' if font.Font().measure(text) > trimWidth else ''}")
 
-        return maxOrder + 1 
-        
+    def log(self, message: str):
+        """
+            Displays the log message to both the console and screen
+        """
+        print(message)      # print to console 
 
-        
-        
+        # print to gui console and log file
+        self.output.write(message)
+            
 class OutputConsole(tk.Frame):
-    def __init__(self, parent):
+    """
+        A read-only console that keeps only its last maxLines lines.
+        Messages may be written from any thread, they are queued and drawn in batches every flushInterval ms.
+        Every message is also written to the file at logPath as soon as it is logged, so the file is complete even if the app exits before a flush
+    """
+    def __init__(self, parent, maxLines: int = 1000, flushInterval: int = 100, logPath: str = None):
         super().__init__(parent)
         font = ("Helvetica", 10)
+        self.maxLines = maxLines
+        self.flushInterval = flushInterval
+        self.lineCount = 0
+        self.pending = queue.Queue()
+        self.logFile = open(logPath, "a", encoding="utf-8") if logPath != None else None
+        self.logLock = threading.Lock()
 
         # instances
         self.scrollBar = tk.Scrollbar(self, orient="vertical")
@@ -1126,6 +1454,50 @@ class OutputConsole(tk.Frame):
         self.output.config(yscrollcommand=self.scrollBar.set)
         self.scrollBar.configure(command=self.output.yview)
 
+        self.flushId = self.after(self.flushInterval, self._flush)
+
+    def write(self, message: str):
+        """
+            Writes the message to the log file and queues it to be displayed on the next flush
+        """
+        with self.logLock:
+            if self.logFile != None:
+                self.logFile.write(f"{message}\n")
+                self.logFile.flush()
+        self.pending.put(message)
+
+    def destroy(self):
+        self.after_cancel(self.flushId)
+        with self.logLock:
+            if self.logFile != None:
+                self.logFile.close()
+                self.logFile = None
+        super().destroy()
+
+    def _flush(self):
+        """
+            Displays all queued messages at once and drops the oldest lines past maxLines
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(messages) > 0:
+            text = "".join(f"{message}\n" for message in messages)
+            self.output.configure(state="normal")
+            self.output.insert(tk.END, text)
+            self.lineCount += text.count("\n")
+            if self.lineCount > self.maxLines:
+                self.output.delete("1.0", f"{self.lineCount - self.maxLines + 1}.0")
+                self.lineCount = self.maxLines
+            self.output.configure(state="disabled")
+            self.output.see(tk.END)
+
+        self.flushId = self.after(self.flushInterval, self._flush)
+
 class ProgressBar(tk.Frame):
     style = None
 
@@ -0,0 +1,175 @@
+#
+# journal.py
+#
+# Contains the append-only journal of a trimming session, kept in the destination folder so an interrupted batch can be resumed
+#
+
+import os
+import json
+import time
+import threading
+
+JOURNAL_NAME = ".trimjournal.jsonl"
+
+# states of a clip
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+STATE_SKIPPED = "skipped"
+
+
+class TrimJournal():
+    """
+        Records every committed clip and every change of a clip's state as one JSON line.
+        Each line is flushed to disk before returning, so a crash loses at most the line being written
+    """
+    def __init__(self, destFolder: str):
+        self.path = getJournalPath(destFolder)
+        self.lock = threading.Lock()
+        self.isTailChecked = False      # a resumed journal may end with a line cut short by a crash
+
+    def start(self, videoPaths: list):
+        """
+            Begins a new session, replacing any previous journal in the folder
+        """
+        with self.lock:
+            with open(self.path, "w", encoding="utf-8") as file:
+                self._writeLine(file, dict(event="session", videoPaths=list(videoPaths), time=time.time()))
+            self.isTailChecked = True
+
+    def setVideo(self, videoNumber: int):
+        self._append(dict(event="video", videoNumber=videoNumber))
+
+    def addClip(self, trimData: dict):
+        self._append(dict(event="clip", clip=trimData))
+
+    def removeClip(self):
+        """
+            Removes the last committed clip
+        """
+        self._append(dict(event="pop"))
+
+    def setTrimming(self, options: dict = None):
+        """
+            Marks the end of clip selection, recording the values of the options the clips are trimmed with so a resumed batch keeps them
+        """
+        record = dict(event="trim")
+        if options != None: record["options"] = options
+        self._append(record)
+
+    def setState(self, jobId: int, state: str, order: int = None, outputPath: str = None, error: str = None):
+        """
+            Records the new state of the clip at index jobId.
+            Finished clips also record the size of their output, which is checked before the clip is skipped on resume
+        """
+        record = dict(event="state", jobId=jobId, state=state)
+        if order != None: record["order"] = order
+        if outputPath != None:
+            record["outputPath"] = outputPath
+            record["size"] = os.path.getsize(outputPath)
+        if error != None: record["error"] = error
+        self._append(record)
+
+    def finish(self):
+        """
+            Marks the session as complete, it is no longer offered for resuming
+        """
+        self._append(dict(event="finish"))
+
+    def _append(self, record: dict):
+        with self.lock:
+            if not self.isTailChecked:
+                self._removePartialLine()
+                self.isTailChecked = True
+            with open(self.path, "a", encoding="utf-8") as file:
+                self._writeLine(file, record)
+
+    def _removePartialLine(self):
+        """
+            Truncates the journal after its last complete line, so the next record is not glued onto a line cut short by a crash
+        """
+        if not os.path.exists(self.path): return
+        with open(self.path, "rb+") as file:
+            data = file.read()
+            if len(data) == 0 or data.endswith(b"\n"): return
+            file.truncate(data.rfind(b"\n") + 1)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _writeLine(self, file, record: dict):
+        file.write(json.dumps(record) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+
+def getJournalPath(destFolder: str):
+    return os.path.join(destFolder, JOURNAL_NAME)
+
+def readJournal(destFolder: str):
+    """
+        Replays the journal in the folder.
+        Returns None if there is none, otherwise a dict of videoPaths, currentVideo, clips (list of trimData),
+        isTrimming, options (name: value), isFinished, states (jobId: last state record) and orders (jobId: output number)
+    """
+    path = getJournalPath(destFolder)
+    if not os.path.exists(path): return None
+
+    session = None
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue    # partial line from a crash, the lines around it are intact
+
+            event = record.get("event")
+            if event == "session":
+                session = dict(videoPaths=record["videoPaths"], currentVideo=1, clips=[], isTrimming=False, options=dict(), isFinished=False, states=dict(), orders=dict())
+            elif session == None:
+                continue
+            elif event == "video":
+                session["currentVideo"] = record["videoNumber"]
+            elif event == "clip":
+                session["clips"].append(record["clip"])
+            elif event == "pop" and len(session["clips"]) > 0:
+                session["clips"].pop()
+            elif event == "trim":
+                session["isTrimming"] = True
+                session["options"].update(record.get("options", dict()))
+            elif event == "state":
+                session["states"][record["jobId"]] = record
+                if "order" in record: session["orders"][record["jobId"]] = record["order"]
+            elif event == "finish":
+                session["isFinished"] = True
+
+    return session
+
+def getResumableSession(destFolder: str):
+    """
+        Returns the unfinished session in the folder, or None if there is nothing to resume
+    """
+    try:
+        session = readJournal(destFolder)
+    except (OSError, KeyError):
+        return None
+    if session == None or session["isFinished"]: return None
+    if len(session["clips"]) == 0 and session["currentVideo"] <= 1: return None
+    if any(not os.path.exists(path) for path in session["videoPaths"]): return None
+
+    return session
+
+def isOutputVerified(record: dict):
+    """
+        Returns True if the state record is of a finished clip whose output is still on disk at its recorded size
+    """
+    if record.get("state") != STATE_DONE: return False
+    outputPath = record.get("outputPath")
+    return outputPath != None and os.path.exists(outputPath) and os.path.getsize(outputPath) == record.get("size")
+
+def getFinishedJobs(session: dict):
+    """
+        Returns the set of clips that do not need to be trimmed again: skipped clips and finished clips with a verified output
+    """
+    return set(jobId for jobId, record in session["states"].items() if record["state"] == STATE_SKIPPED or isOutputVerified(record))
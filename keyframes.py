@@ -0,0 +1,132 @@
+#
+# keyframes.py
+#
+# Contains a persistent keyframe index built once per input file
+#
+
+import os
+import subprocess
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+import cache
+from cache import CREATION_FLAGS
+import tracing
+
+# indexes loaded during this session
+_indexes = dict()
+_indexLocks = dict()
+_pending = set()
+_lock = threading.Lock()
+
+
+def getKeyframes(inputPath: str):
+    """
+        Returns a sorted array of every video keyframe time (in seconds) within the file.
+        The index is built with a single ffprobe pass on first use and is read from the cache after that.
+        Returns an empty array if the index could not be built
+    """
+    key = cache.getFileKey(inputPath)
+
+    # only one thread builds the index of a given file
+    with _lock:
+        if key in _indexes: return _indexes[key]
+        indexLock = _indexLocks.setdefault(key, threading.Lock())
+
+    with indexLock:
+        if key in _indexes: return _indexes[key]
+
+        cachePath = os.path.join(cache.getCacheDir("keyframes"), f"{key}.bin")
+        keyframes = array("d")
+        if os.path.exists(cachePath):
+            with open(cachePath, "rb") as file:
+                keyframes.frombytes(file.read())
+        else:
+            with tracing.span("buildKeyframeIndex", input=inputPath):
+                keyframes = _buildIndex(inputPath)
+            if len(keyframes) > 0:
+                cache.writeFileAtomic(cachePath, keyframes.tobytes())
+
+        with _lock:
+            _indexes[key] = keyframes
+        return keyframes
+
+def getCachedKeyframes(inputPath: str):
+    """
+        Returns the keyframe index of the file if it is loaded, otherwise starts building it on a thread and returns None.
+        Never blocks, so it is safe to call from the GUI thread
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError:
+        return None
+
+    with _lock:
+        if key in _indexes: return _indexes[key]
+        if key in _pending: return None
+        _pending.add(key)
+
+    def _load():
+        try:
+            getKeyframes(inputPath)
+        finally:
+            with _lock:
+                _pending.discard(key)
+    threading.Thread(target=_load, daemon=True).start()
+    return None
+
+def _buildIndex(inputPath: str):
+    """
+        Reads the keyframe flag of every video packet from the demuxer, without decoding any frames
+    """
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',                   # set video stream to default
+        '-show_entries', 'packet=pts_time,flags',   # outputs the timestamp and keyframe flag
+        '-of', 'csv=print_section=0',               # set output format
+        str(inputPath)                              # set input file
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, creationflags=CREATION_FLAGS)
+
+    keyframes = set()
+    for line in result.stdout.split('\n'):
+        values = line.split(",")
+        if len(values) < 2 or 'K' not in values[1]: continue
+        try:
+            keyframes.add(float(values[0]))
+        except ValueError:
+            continue        # N/A timestamps
+
+    return array("d", sorted(keyframes))
+
+def getPreviousKeyframe(keyframes: array, time: float):
+    """
+        Returns the last keyframe at or before the given time, or None if there is none
+    """
+    index = bisect_right(keyframes, time)
+    return keyframes[index-1] if index > 0 else None
+
+def getNextKeyframe(keyframes: array, time: float):
+    """
+        Returns the first keyframe at or after the given time, or None if there is none
+    """
+    index = bisect_left(keyframes, time)
+    return keyframes[index] if index < len(keyframes) else None
+
+def getNearestKeyframe(keyframes: array, time: float):
+    """
+        Returns the keyframe closest to the given time, or None if there are none
+    """
+    previous = getPreviousKeyframe(keyframes, time)
+    next = getNextKeyframe(keyframes, time)
+    if previous == None: return next
+    if next == None: return previous
+    return previous if time - previous <= next - time else next
+
+def isKeyframe(keyframes: array, time: float, tolerance: float = .001):
+    """
+        Returns true if there is a keyframe within tolerance seconds of the given time
+    """
+    nearest = getNearestKeyframe(keyframes, time)
+    return nearest != None and abs(nearest - time) <= tolerance
@@ -5,211 +5,854 @@
 #
 
 import multiprocessing
+import json
 import subprocess
 import os
 import tempfile
 import threading
+import queue
+import time
+from contextlib import contextmanager
+import numpy as np
+import keyframes as keyframeIndex
+import profiles
+import cache
+from cache import CREATION_FLAGS
+import probe
+import tracing
+import journal
+from concurrent.futures import ThreadPoolExecutor
+
+# encoders able to produce segments that can be joined losslessly with the source stream
+SMART_RENDER_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+SMART_RENDER_PROFILES = {       # ffprobe profile name: encoder profile, files in other profiles are not smart rendered
+    "h264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high", "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"},
+    "hevc": {"Main": "main", "Main 10": "main10", "Main Still Picture": "mainstillpicture"}
+}
+
+# job types of the thread budget
+JOB_ENCODE = "encode"
+JOB_COPY = "copy"
+JOB_DECODE = "decode"
+
+# audio codecs that can be copied into an mp4 output without re-encoding
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "alac", "opus"}
+
+# seconds of packets read on each side of a cut by the fallback keyframe search, grown if a GOP is longer
+KEYFRAME_SEARCH_WINDOW = 10
+
+# silence detection
+SILENCE_THRESHOLD_DB = -90      # RMS and peak level below which a chunk of audio is considered silent
+SILENCE_SAMPLE_RATE = 16000
+SILENCE_CHUNK_DURATION = .25    # seconds of audio analysed at a time
+
+# output number reservations shared by every writer of a destination folder
+OUTPUT_COUNTER_NAME = ".trimnumber"
+OUTPUT_LOCK_STALE = 30          # seconds after which a lock left by a crashed writer is removed
+OUTPUT_LOCK_TIMEOUT = 2 * OUTPUT_LOCK_STALE     # seconds to wait for the lock of another writer, longer than the stale age so a crashed writer's lock is removed first
+OUTPUT_COUNTER_EXPIRY = 24*60*60    # seconds after which the counter is ignored, so numbering restarts after outputs are deleted
 
 # set ffmpeg path temporarily
-os.environ["PATH"] = f"{os.getcwd()}" + r'\ffmpeg\bin' + f"{os.pathsep}{os.environ['PATH']}"
+os.environ["PATH"] = os.path.join(os.getcwd(), "ffmpeg", "bin") + f"{os.pathsep}{os.environ['PATH']}"
 
 
-def trimVideo(inputPath: str, outputPath: str, startTime: float, endTime: float, isFramePerfect: bool, fullVideoLength: float, trimScene = None):
+
+class TrimPool():
     """
-        Trims the provided video and writes it to outputPath based on given params
+        A bounded pool of worker threads used to run several trim jobs at once.
+        Finished jobs are collected with getResults() so that the caller can report on each job from its own thread
     """
-    # start by checking for any video already in the output
-    if os.path.exists(outputPath):
-        raise Exception(f"Video already exists: [{outputPath}]")
+    def __init__(self, maxWorkers: int):
+        self.maxWorkers = max(1, maxWorkers)
+        self.executor = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="trim")
+        self.results = queue.Queue()
+        self.pendingJobs = 0
+
+    def submit(self, jobId, function, *args, **kwargs):
+        """
+            Queues the function to be run on the next free worker.
+            The jobId is returned alongside the result of the job
+        """
+        def runJob():
+            try:
+                self.results.put((jobId, True, function(*args, **kwargs)))
+            except Exception as e:
+                self.results.put((jobId, False, e))
+
+        self.pendingJobs += 1
+        self.executor.submit(runJob)
+
+    def getResults(self):
+        """
+            Returns a list of (jobId, isSuccess, value) for every job finished since the last call.
+            value is the return value of the job on success, otherwise the raised exception
+        """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
 
-    if isFramePerfect:
-        # Get the number of CPU cores
-        threads = multiprocessing.cpu_count()       # logical processors, not physical cores
+        self.pendingJobs -= len(results)
+        return results
 
-        # delete unprocessed file if needed
-        if os.path.exists(outputPath):
-            os.remove(outputPath)
+    def isDone(self):
+        """
+            Returns true if every submitted job has been collected
+        """
+        return self.pendingJobs == 0
 
-        command = [
-            'ffmpeg',
-            '-ss', str(startTime),      # set start time
-            '-to', str(endTime + 16/1000), # set end time (16/1000 includes final frame)
-            '-i', str(inputPath),       # set input file
-            '-c:v', 'libx264',          # set video codec
-            '-crf', '15',               # set quality (0=lossless)
-            '-preset', 'medium',        # set encoding time to file size ratio
-            '-threads', str(threads-2), # set thread count
-            '-c:a', 'libmp3lame',       # set audio codec
-            '-b:a', '320k',             # set audio bitrate
-            str(outputPath)             # set output file
-        ]
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+
+class ThreadBudget():
+    """
+        Shares the logical cores of the machine between the ffmpeg processes running at once.
+        Stream copies and audio decodes get a single thread each, encodes split the remaining cores evenly
+        between the encodes expected to run at the same time
+    """
+    def __init__(self, totalThreads: int = None):
+        self.totalThreads = max(1, totalThreads or multiprocessing.cpu_count())      # logical processors, not physical cores
+        self.maxConcurrentJobs = self.totalThreads
+        self.queuedJobs = {JOB_ENCODE: 0, JOB_COPY: 0, JOB_DECODE: 0}
+        self.runningJobs = {JOB_ENCODE: 0, JOB_COPY: 0, JOB_DECODE: 0}
+        self.lock = threading.Lock()
+
+    def setConcurrency(self, maxJobs: int):
+        """
+            Sets the number of jobs that can run at once, usually the worker count of the pool
+        """
+        with self.lock:
+            self.maxConcurrentJobs = max(1, maxJobs)
+
+    def addJob(self, jobType: str):
+        """
+            Counts a job that is queued but not yet started, so that early encodes do not take every core
+        """
+        with self.lock:
+            self.queuedJobs[jobType] += 1
+
+    def removeJob(self, jobType: str):
+        with self.lock:
+            self.queuedJobs[jobType] = max(0, self.queuedJobs[jobType] - 1)
+
+    @contextmanager
+    def acquire(self, jobType: str):
+        """
+            Reserves threads for a running process of the given type, yields the number of threads it may use
+        """
+        with self.lock:
+            self.runningJobs[jobType] += 1
+            threads = self._getShare(jobType)
+        try:
+            yield threads
+        finally:
+            with self.lock:
+                self.runningJobs[jobType] -= 1
+
+    def _getShare(self, jobType: str):
+        if jobType != JOB_ENCODE: return 1
+
+        lightJobs = self.runningJobs[JOB_COPY] + self.runningJobs[JOB_DECODE]
+        expectedEncodes = max(1, min(self.maxConcurrentJobs, max(self.queuedJobs[JOB_ENCODE], self.runningJobs[JOB_ENCODE])))
+        return max(1, (self.totalThreads - lightJobs) // expectedEncodes)
+
+threadBudget = ThreadBudget()
+
+
+
+def _runCommand(command: list, trimScene = None, captureOutput: bool = False, onProgress = None, duration: float = 0):
+    """
+        Runs the command to completion and returns the finished process.
+        Keeps the trim scene responsive while waiting if provided, otherwise blocks the calling thread (used by worker threads).
+        The command never reads the terminal, so several can run at once from the command line or in the background
+
+        Params:
+        onProgress: for ffmpeg commands, called with (fraction complete, encode fps, speed) as ffmpeg reports progress
+        duration: length in seconds of the output, used to find the fraction complete
+    """
+    with tracing.span(os.path.basename(command[0]), command=subprocess.list2cmdline(command)):
+        if onProgress != None:
+            return _runWithProgress(command, onProgress, duration)
+
+        if trimScene == None:
+            return subprocess.run(command, capture_output=captureOutput, text=captureOutput, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
 
         # exec on separate thread
+        results = dict()
         def execCommand():
-            subprocess.run(command, creationflags=subprocess.CREATE_NO_WINDOW)
+            results["return"] = subprocess.run(command, capture_output=captureOutput, text=captureOutput, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
         cmdThread = threading.Thread(target=execCommand)
         cmdThread.start()
 
         while cmdThread.is_alive():
             trimScene.root.update()
-            
 
-        
+        return results["return"]
+
+
+def _runWithProgress(command: list, onProgress, duration: float):
+    """
+        Runs the ffmpeg command on the calling thread while reading its machine readable progress output
+    """
+    command = command[:1] + ['-progress', 'pipe:1', '-nostats'] + command[1:]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+
+    # each report is a block of key=value lines ending with progress=continue/end
+    report = dict()
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        report[key] = value
+        if key != "progress": continue
+
+        outTime = _parseProgressValue(report.get("out_time_us", report.get("out_time_ms", "0"))) / 1000000
+        fraction = max(0, min(1, outTime / duration)) if duration > 0 else 0
+        onProgress(fraction, _parseProgressValue(report.get("fps", "0")), _parseProgressValue(report.get("speed", "0x")))
+
+    process.wait()
+    return process
+
+def _parseProgressValue(value: str):
+    """
+        Returns the number in a progress value such as 1.5x, or 0 if not available
+    """
+    try:
+        return float(value.strip().rstrip("x"))
+    except ValueError:
+        return 0
+
+def _scaleProgress(onProgress, start: float, size: float):
+    """
+        Returns a progress callback that reports a single step as the range [start, start+size] of the whole job
+    """
+    if onProgress == None: return None
+    return lambda fraction, fps, speed: onProgress(start + fraction * size, fps, speed)
+
+def groupTrimJobs(jobs: list):
+    """
+        Splits a list of (jobId, trimData, outputOrder) into the groups to be passed to runTrimJobs.
+        Frame perfect clips are run alone, stream copied clips of the same video are grouped so the video is only read once
+    """
+    groups = []
+    copyGroups = dict()
+    for job in jobs:
+        if job[1]["isFramePerfect"]:
+            groups.append([job])
+        else:
+            copyGroups.setdefault(job[1]["inputPath"], []).append(job)
+
+    return groups + list(copyGroups.values())
+
+def submitTrimJobs(pool: TrimPool, jobs: list, destFolder: str, labelSilentClips: bool, onProgress = None, trimJournal = None):
+    """
+        Groups the list of (jobId, trimData, outputOrder) and queues each group on the pool.
+        The pool job id of each group is its list of jobIds, and its result the output path of each clip.
+        onProgress is called with (jobId, fraction complete, encode fps, speed) for frame perfect clips.
+        If a TrimJournal is given, every state change of each clip is recorded in it
+    """
+    threadBudget.setConcurrency(pool.maxWorkers)
+
+    for group in groupTrimJobs(jobs):
+        jobIds = [jobId for jobId, _, _ in group]
+        jobType = JOB_ENCODE if group[0][1]["isFramePerfect"] else JOB_COPY
+        groupProgress = None
+        if onProgress != None and jobType == JOB_ENCODE:
+            groupProgress = lambda fraction, fps, speed, jobId=jobIds[0]: onProgress(jobId, fraction, fps, speed)
+
+        threadBudget.addJob(jobType)
+        if trimJournal == None:
+            pool.submit(jobIds, runTrimJobs, [(trimData, order) for _, trimData, order in group], destFolder, labelSilentClips, onProgress=groupProgress, jobType=jobType, jobIds=jobIds)
+            continue
+
+        for jobId, _, order in group:
+            trimJournal.setState(jobId, journal.STATE_QUEUED, order=order)
+        pool.submit(jobIds, _runJournaledTrimJobs, trimJournal, jobIds, [(trimData, order) for _, trimData, order in group], destFolder, labelSilentClips, onProgress=groupProgress, jobType=jobType)
+
+def _runJournaledTrimJobs(trimJournal, jobIds: list, jobs: list, *args, **kwargs):
+    for jobId in jobIds:
+        trimJournal.setState(jobId, journal.STATE_RUNNING)
+
+    try:
+        outputPaths = runTrimJobs(jobs, *args, jobIds=jobIds, **kwargs)
+    except Exception as e:
+        for jobId in jobIds:
+            trimJournal.setState(jobId, journal.STATE_FAILED, error=str(e))
+        raise
+
+    for jobId, outputPath in zip(jobIds, outputPaths):
+        trimJournal.setState(jobId, journal.STATE_DONE, outputPath=outputPath)
+    return outputPaths
+
+def runTrimJobs(jobs: list, destFolder: str, labelSilentClips: bool, onProgress = None, jobType: str = None, jobIds: list = None):
+    """
+        Trims the given list of (trimData, outputOrder) into destFolder, usually run on a worker thread.
+        Several jobs must all be stream copied from the same video (see groupTrimJobs), they are then written by a single ffmpeg run.
+        onProgress is passed to trimVideo for single frame perfect clips.
+        jobType is the type the job was queued as on the thread budget, if any.
+        jobIds are the ids of the clips, only used to label the trace.
+        Returns the output path of each clip
+    """
+    try:
+        with tracing.span("trimJobs", jobIds=jobIds, input=jobs[0][0]["inputPath"], clips=len(jobs), jobType=jobType) as spanArgs:
+            outputPaths = _runTrimJobs(jobs, destFolder, labelSilentClips, onProgress)
+            spanArgs["bytes"] = sum(os.path.getsize(outputPath) for outputPath in outputPaths)
+            return outputPaths
+    finally:
+        if jobType != None: threadBudget.removeJob(jobType)
+
+def _runTrimJobs(jobs: list, destFolder: str, labelSilentClips: bool, onProgress = None):
+    inputPath = jobs[0][0]["inputPath"]
+
+    clips = []
+    for trimData, outputOrder in jobs:
+        outputPath = getOutputPath(destFolder, trimData, outputOrder)
+        clips.append(dict(outputPath=outputPath, startTime=trimData["startTime"] / 1000, endTime=trimData["endTime"] / 1000, isKeyframeAligned=trimData.get("isKeyframeAligned", False)))
+
+    # silence is measured in the same ffmpeg run as the trim
+    try:
+        trimData = jobs[0][0]
+        if len(clips) == 1:
+            silentClips = [trimVideo(inputPath=inputPath, outputPath=clips[0]["outputPath"], startTime=clips[0]["startTime"], endTime=clips[0]["endTime"], isFramePerfect=trimData["isFramePerfect"], fullVideoLength=trimData['fullVideoLength'], isSmartRender=trimData.get("isSmartRender", False), detectSilence=labelSilentClips, onProgress=onProgress, encoderProfile=trimData.get("encoderProfile"), isKeyframeAligned=clips[0]["isKeyframeAligned"])]
+        else:
+            silentClips = trimVideos(inputPath=inputPath, clips=clips, fullVideoLength=trimData['fullVideoLength'], detectSilence=labelSilentClips)
+    except Exception as e:
+        remaining = [clip["outputPath"] for clip in clips if os.path.exists(clip["outputPath"])]
+        if len(remaining) > 0:
+            raise Exception(f"{e} (file remains in directory {', '.join(remaining)})")
+        raise
+
+    # label silent clips once written
+    for (trimData, outputOrder), clip, isSilent in zip(jobs, clips, silentClips):
+        if not isSilent: continue
+        silentPath = getOutputPath(destFolder, trimData, outputOrder, isSilent=True)
+        with tracing.span("labelSilentClip", output=silentPath):
+            os.rename(clip["outputPath"], silentPath)
+        clip["outputPath"] = silentPath
+
+    return [clip["outputPath"] for clip in clips]
+
+def getOutputPath(destFolder: str, trimData: dict, outputOrder: int, isSilent: bool = False):
+    """
+        Returns the path of the clip's output, labelled (no sound) if isSilent is set
+    """
+    return f"{destFolder}/({outputOrder}) {'(no sound) ' if isSilent else ''}{trimData['description']}.mp4"
+
+def removeUnfinishedOutput(destFolder: str, trimData: dict, outputOrder: int):
+    """
+        Removes what an interrupted or failed trim of the clip left under its output number, so it can be trimmed again with the same number
+    """
+    for isSilent in [False, True]:
+        outputPath = getOutputPath(destFolder, trimData, outputOrder, isSilent=isSilent)
+        if os.path.exists(outputPath):
+            os.remove(outputPath)
+
+class OutputNumbers():
+    """
+        Hands out the (X) numbers of output files in a destination folder.
+        The folder is scanned once, after which the next free number is kept in memory and in a counter file.
+        Reservations hold a lock file, so workers and other instances of the app writing to the same folder never get the same number
+    """
+    def __init__(self, destFolder: str):
+        self.counterPath = os.path.join(destFolder, OUTPUT_COUNTER_NAME)
+        self.lockPath = self.counterPath + ".lock"
+        self.destFolder = destFolder
+        self.nextNumber = None
+        self.lock = threading.Lock()
+
+    def reserve(self, count: int = 1):
+        """
+            Reserves count consecutive numbers, returns the first
+        """
+        with self.lock, tracing.span("reserveOutputNumber", count=count):
+            # scanned before taking the file lock so it is only held briefly, numbers taken meanwhile are in the counter
+            if self.nextNumber == None:
+                with tracing.span("getFileOrder", folder=self.destFolder):
+                    self.nextNumber = getFileOrder(self.destFolder)      # only scan once
+
+            self._acquireFileLock()
+            try:
+                number = max(self.nextNumber, self._readCounter())
+                self.nextNumber = number + count
+                cache.writeFileAtomic(self.counterPath, str(self.nextNumber).encode("utf-8"))
+            finally:
+                os.remove(self.lockPath)
+
+        return number
+
+    def _readCounter(self):
+        try:
+            if time.time() - os.path.getmtime(self.counterPath) > OUTPUT_COUNTER_EXPIRY: return 0
+            with open(self.counterPath, encoding="utf-8") as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def _acquireFileLock(self):
+        timeout = time.time() + OUTPUT_LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(self.lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                pass
+
+            # remove the lock of a writer that crashed while holding it
+            try:
+                if time.time() - os.path.getmtime(self.lockPath) > OUTPUT_LOCK_STALE:
+                    os.remove(self.lockPath)
+                    continue
+            except OSError:
+                continue        # released in the meantime
+
+            if time.time() > timeout:
+                raise Exception(f"Timed out waiting for {self.lockPath}, delete it if no other trim is writing to this folder")
+            time.sleep(.01)
+
+outputNumbers = dict()      # destination folder: OutputNumbers
+outputNumbersLock = threading.Lock()
+
+def getOutputNumbers(destFolder: str):
+    """
+        Returns the allocator of the destination folder, shared by every caller in this process
+    """
+    with outputNumbersLock:
+        key = os.path.normcase(os.path.abspath(destFolder))
+        if key not in outputNumbers:
+            outputNumbers[key] = OutputNumbers(destFolder)
+        return outputNumbers[key]
+
+def getFileOrder(directoryPath: str):
+    """
+        Returns the highest file number within the directory path +1.
+        The file number is given by (X) before the filenames
+    """
+    files = os.listdir(directoryPath)
+
+    maxOrder = 0
+    for file in files:
+        if len(file) < 3: continue
+        if file[0] != '(': continue
+
+        split = file.split(')')[0]
+        if len(split) == len(file): continue
+        split = split[1:]
+
+        if not split.isnumeric(): continue
+        split = float(split)
+        if split != int(split): continue
+        value = int(split)
+
+        if value > maxOrder: maxOrder = value
+
+    return maxOrder + 1
+
+
+def trimVideo(inputPath: str, outputPath: str, startTime: float, endTime: float, isFramePerfect: bool, fullVideoLength: float, trimScene = None, isSmartRender: bool = False, detectSilence: bool = False, onProgress = None, encoderProfile: str = None, isKeyframeAligned: bool = False):
+    """
+        Trims the provided video and writes it to outputPath based on given params
+
+        Params:
+        isSmartRender: for frame perfect trims, re-encode only the partial GOPs at either end and copy the rest
+        detectSilence: measure the alternate audio track within the same ffmpeg run, returns true if the clip is silent
+        onProgress: for frame perfect trims, called from this thread with (fraction complete, encode fps, speed)
+        encoderProfile: name of the profile in profiles.ENCODER_PROFILES used for frame perfect trims
+        isKeyframeAligned: for stream copies, the times are already keyframes (or the bounds of the video) and are not searched
+    """
+    mode = ("smartRender" if isSmartRender else "encode") if isFramePerfect else "copy"
+    with tracing.span("trimVideo", input=inputPath, output=outputPath, mode=mode, startTime=startTime, endTime=endTime) as spanArgs:
+        isSilent = _trimVideo(inputPath, outputPath, startTime, endTime, isFramePerfect, fullVideoLength, trimScene, isSmartRender, detectSilence, onProgress, encoderProfile, isKeyframeAligned)
+        spanArgs["bytes"] = os.path.getsize(outputPath)
+        return isSilent
+
+def _trimVideo(inputPath: str, outputPath: str, startTime: float, endTime: float, isFramePerfect: bool, fullVideoLength: float, trimScene, isSmartRender: bool, detectSilence: bool, onProgress, encoderProfile: str, isKeyframeAligned: bool):
+    # start by checking for any video already in the output
+    if os.path.exists(outputPath):
+        raise Exception(f"Video already exists: [{outputPath}]")
+
+    if not isFramePerfect:
+        return trimVideos(inputPath=inputPath, clips=[dict(outputPath=outputPath, startTime=startTime, endTime=endTime, isKeyframeAligned=isKeyframeAligned)], fullVideoLength=fullVideoLength, trimScene=trimScene, detectSilence=detectSilence)[0]
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        statsPath = None
+        if detectSilence and _getAudioStreamCount(inputPath) >= 2:
+            statsPath = os.path.join(tempDir, "stats.txt")
+
+        profile = profiles.getEncoderProfile(encoderProfile)
+        with threadBudget.acquire(JOB_ENCODE) as threads:
+            if isSmartRender and _smartRender(inputPath, outputPath, startTime, endTime, trimScene=trimScene, statsPath=statsPath, onProgress=onProgress, profile=profile, threads=threads):
+                return _readSilenceStats(statsPath) if detectSilence else None
+
+            # delete unprocessed file if needed
+            if os.path.exists(outputPath):
+                os.remove(outputPath)
+
+            command = [
+                'ffmpeg', '-loglevel', 'error', '-nostats',
+                '-ss', str(startTime),      # set start time
+                '-to', str(endTime + 16/1000), # set end time (16/1000 includes final frame)
+                '-i', str(inputPath),       # set input file
+                *profiles.getVideoOptions(profile),
+                '-threads', str(threads),   # set thread count
+                *_getAudioOptions(inputPath, profile),
+                str(outputPath)             # set output file
+            ]
+            if statsPath != None:
+                command += _getSilenceOutput(0, statsPath)
+
+            result = _runCommand(command, trimScene=trimScene, onProgress=onProgress, duration=endTime - startTime)
+            if result.returncode != 0:
+                raise Exception(f"ffmpeg exited with code {result.returncode}")
+
+        return _readSilenceStats(statsPath) if detectSilence else None
+
+
+
+def trimVideos(inputPath: str, clips: list, fullVideoLength: float, trimScene = None, detectSilence: bool = False):
+    """
+        Stream copies several clips of the same video in a single ffmpeg run, so the input is only read once.
+        Each clip is a dict of outputPath, startTime and endTime, the range is grown to the adjacent keyframes
+        unless the clip sets isKeyframeAligned.
+        Returns a list with whether each clip is silent if detectSilence is set, otherwise a list of None
+    """
+    for clip in clips:
+        if os.path.exists(clip["outputPath"]):
+            raise Exception(f"Video already exists: [{clip['outputPath']}]")
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        hasAltTrack = detectSilence and _getAudioStreamCount(inputPath) >= 2
+
+        command = ['ffmpeg', '-loglevel', 'quiet', '-i', inputPath]
+        statsPaths = []
+        for index, clip in enumerate(clips):
+            if clip.get("isKeyframeAligned", False):
+                keyStartTime, keyEndTime = clip["startTime"], clip["endTime"]      # snapped when selected
+            else:
+                with tracing.span("keyframeRange", input=inputPath, startTime=clip["startTime"], endTime=clip["endTime"]):
+                    keyStartTime, keyEndTime = _getKeyframeRange(inputPath, clip["startTime"], clip["endTime"], fullVideoLength, trimScene=trimScene)
+
+            # extract on the corrected times
+            command += ['-ss', str(keyStartTime-.1), '-to', str(keyEndTime+.1), '-c', 'copy', '-map', '0', clip["outputPath"]]
+
+            # measure the same range in this run
+            statsPaths.append(os.path.join(tempDir, f"stats{index}.txt") if hasAltTrack else None)
+            if hasAltTrack:
+                command += ['-ss', str(keyStartTime-.1), '-to', str(keyEndTime+.1)] + _getSilenceOutput(0, statsPaths[-1])
+
+        with threadBudget.acquire(JOB_COPY), tracing.span("streamCopy", input=inputPath, clips=len(clips)):
+            result = _runCommand(command, trimScene=trimScene)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg exited with code {result.returncode}")
+
+        return [_readSilenceStats(statsPath) if detectSilence else None for statsPath in statsPaths]
+
+def _getKeyframeRange(inputPath: str, startTime: float, endTime: float, fullVideoLength: float, trimScene = None):
+    """
+        Returns the keyframe at or before startTime and the keyframe at or after endTime
+    """
+    keyframes = keyframeIndex.getKeyframes(inputPath)
+    if len(keyframes) == 0:
+        return _searchKeyframes(inputPath, startTime, endTime, fullVideoLength, trimScene=trimScene)
+
+    keyStartTime = keyframeIndex.getPreviousKeyframe(keyframes, startTime)
+    keyEndTime = keyframeIndex.getNextKeyframe(keyframes, endTime)
+    if keyStartTime == None: keyStartTime = 0
+    if keyEndTime == None: keyEndTime = fullVideoLength/1000
+    return keyStartTime, keyEndTime
+
+
+
+def _smartRender(inputPath: str, outputPath: str, startTime: float, endTime: float, trimScene = None, statsPath: str = None, onProgress = None, profile: dict = None, threads: int = 1):
+    """
+        Frame perfect trim that re-encodes only the partial GOPs at the start and end of the range.
+        Everything between the first and last keyframe of the range is stream copied and the pieces are joined losslessly.
+        The re-encoded GOPs use the profile, level and reference frames of the source, and the joined video is checked around each join.
+        Returns false without writing anything if the file cannot be smart rendered, or if the joined video has a frame too many or too few
+        or does not decode cleanly around a join
+    """
+    with tracing.span("keyframeIndex", input=inputPath):
+        keyframes = keyframeIndex.getKeyframes(inputPath)
+    firstKeyframe = keyframeIndex.getNextKeyframe(keyframes, startTime)
+    lastKeyframe = keyframeIndex.getPreviousKeyframe(keyframes, endTime)
+    if firstKeyframe == None or lastKeyframe == None or firstKeyframe >= lastKeyframe: 
+        return False        # no whole GOP to copy
+
+    matchingOptions = _getMatchingVideoOptions(inputPath)
+    fps = probe.getMediaInfo(inputPath)["fps"]
+    if matchingOptions == None or fps <= 0: return False
+    middleFrames = round((lastKeyframe - firstKeyframe) * fps)
+
+    # the encoder must match the source, only the quality settings of the profile apply
+    if profile == None: profile = profiles.getEncoderProfile()
+    encodeOptions = ['-map', '0:v:0', '-an', *matchingOptions, '-crf', str(profile["crf"]), '-preset', profile["preset"], '-threads', str(threads)]
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        # mpeg-ts segments carry their parameter sets in-band, so differing encoder settings survive the join
+        segments = []
+        commands = []
+
+        # start of range to first keyframe
+        if firstKeyframe - startTime > .001:
+            segments.append(os.path.join(tempDir, "head.ts"))
+            commands.append(['ffmpeg', '-loglevel', 'error', '-ss', str(startTime), '-i', str(inputPath), '-t', str(firstKeyframe - startTime)] + encodeOptions + [segments[-1]])
+
+        # whole GOPs, seek slightly past the keyframe to avoid landing on the previous one.
+        # The frames are counted rather than timed, as -t would also keep the last keyframe (its decode time is before the limit) and the tail encodes it again
+        segments.append(os.path.join(tempDir, "middle.ts"))
+        commands.append(['ffmpeg', '-loglevel', 'error', '-ss', str(firstKeyframe + .0005), '-i', str(inputPath), '-frames:v', str(middleFrames), '-map', '0:v:0', '-an', '-c', 'copy', segments[-1]])
+
+        # last keyframe to end of range (16/1000 includes final frame)
+        segments.append(os.path.join(tempDir, "tail.ts"))
+        commands.append(['ffmpeg', '-loglevel', 'error', '-ss', str(lastKeyframe), '-i', str(inputPath), '-t', str(endTime + 16/1000 - lastKeyframe)] + encodeOptions + [segments[-1]])
+
+        # segments are reported as the first 90% of the job, the join as the rest
+        totalDuration = endTime + 16/1000 - startTime
+        segmentStart = startTime
+        for command, segment, segmentEnd in zip(commands, segments, ([firstKeyframe] if len(commands) == 3 else []) + [lastKeyframe, endTime + 16/1000]):
+            segmentProgress = _scaleProgress(onProgress, .9 * (segmentStart - startTime) / totalDuration, .9 * (segmentEnd - segmentStart) / totalDuration)
+            with tracing.span("smartRenderSegment", segment=os.path.splitext(os.path.basename(segment))[0], startTime=segmentStart, endTime=segmentEnd) as spanArgs:
+                result = _runCommand(command, trimScene=trimScene, onProgress=segmentProgress, duration=segmentEnd - segmentStart)
+                if os.path.exists(segment): spanArgs["bytes"] = os.path.getsize(segment)
+            segmentStart = segmentEnd
+            if result.returncode != 0:
+                raise Exception(f"ffmpeg exited with code {result.returncode}")
+
+        # join video and add the audio of the range
+        listPath = os.path.join(tempDir, "segments.txt")
+        with open(listPath, "w") as file:
+            for segment in segments:
+                file.write("file '" + segment.replace("'", "'\\''") + "'\n")
 
-    else:
-        # since this is not frame perfect, need to grab adjactent keyframes
-        interval = 5
         command = [
-            'ffprobe',
-            '-skip_frame', 'nokey',                # skip non-keyframes
-            '-select_streams', 'v:0',              # set video stream to default
-            '-show_entries', 'frame=pts_time',     # outputs only the timestamp
-            '-of', 'csv=print_section=0',          # set output format
-            '-read_intervals', f'{startTime-interval}%{startTime}',      # set time interval
-            str(inputPath)                         # set input file
+            'ffmpeg', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', listPath,                               # set joined video
+            '-ss', str(startTime), '-to', str(endTime + 16/1000), '-i', str(inputPath), # set audio source
+            '-map', '0:v', '-map', '1:a?',
+            '-c:v', 'copy',
+            *_getAudioOptions(inputPath, profile),
+            str(outputPath)
         ]
+        if statsPath != None:
+            command += _getSilenceOutput(1, statsPath)
+        with tracing.span("smartRenderJoin", segments=len(segments)):
+            result = _runCommand(command, trimScene=trimScene, onProgress=_scaleProgress(onProgress, .9, .1), duration=totalDuration)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg exited with code {result.returncode}")
+
+        # only the joins can break, so the frame count and a couple of seconds around each join are checked and anything wrong falls back to a full encode
+        with tracing.span("smartRenderCheck", output=outputPath):
+            encodedFrames = [_getFrameCount(segment, countPackets=True) for segment in segments if os.path.basename(segment) != "middle.ts"]
+            expectedFrames = sum(encodedFrames) + middleFrames if None not in encodedFrames else None
+            joinTimes = ([firstKeyframe - startTime] if len(commands) == 3 else []) + [lastKeyframe - startTime]
+            if expectedFrames == None or _getFrameCount(outputPath) != expectedFrames or not all(_isDecodable(outputPath, joinTime - 1, 2, trimScene=trimScene) for joinTime in joinTimes):
+                os.remove(outputPath)
+                return False
+
+    return True
+
+def _getFrameCount(inputPath: str, countPackets: bool = False):
+    """
+        Returns the number of frames of the first video track, or None if unknown.
+        Read from the header of containers that index their frames (such as mp4), otherwise the packets are counted if countPackets is set
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=nb_frames,nb_read_packets', '-of', 'json', str(inputPath)]
+    if countPackets: command.insert(1, '-count_packets')
+    result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+    try:
+        stream = json.loads(result.stdout)["streams"][0]
+        return int(stream.get("nb_read_packets") or stream["nb_frames"])
+    except (ValueError, KeyError, IndexError):
+        return None
+
+def _isDecodable(inputPath: str, startTime: float, duration: float, trimScene = None):
+    """
+        Returns True if the video track decodes without errors from startTime (in seconds) for duration seconds
+    """
+    command = ['ffmpeg', '-v', 'error', '-ss', str(max(0, startTime)), '-i', str(inputPath), '-t', str(duration), '-map', '0:v:0', '-f', 'null', '-']
+    result = _runCommand(command, trimScene=trimScene, captureOutput=True)
+    return result.returncode == 0 and result.stderr.strip() == ""
 
-        # get keyframe start time
-        #
-        keyStartTime = None
-        while keyStartTime == None:
-            
-            # exec on separate thread
-            def execCommand(event):
-                result = subprocess.run(command, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                event.returnValue = result
-            event = threading.Event()
-            cmdThread = threading.Thread(target=execCommand, args=(event,))
-            cmdThread.start()
-            
-            while cmdThread.is_alive():
-                trimScene.root.update()
-            result = event.returnValue
-
-
-            # clean output
-            output = result.stdout.split('\n')[:-1]
-            cleaned_output = []
-            for line in output:
-                if line != '':
-                    new_line = line.split(",")[0]
-                    cleaned_output.append(new_line)
-            output = cleaned_output
-            
-            
-            # get previous frame
-            if keyStartTime == None:
-                currFrame = None
-                for frame in output:
-                    if float(frame) <= startTime:
-                        currFrame = float(frame)
-                    else: break
-                keyStartTime = currFrame        # keyframe is previous, or none if no frames found
-
-            # if not found and out of bounds, not found
-            if keyStartTime == None and startTime - interval < 0: 
-                keyStartTime = 0
-                break
+def _getAudioStreamCount(inputPath: str):
+    """
+        Returns the number of audio tracks in the file
+    """
+    return len(_getAudioCodecs(inputPath))
 
-            # if not found, increase interval
-            interval += 5
-            command[10] = f'{startTime-interval}%{startTime-interval+5}'
-
-
-        # get keyframe end time
-        #
-        interval = 5
-        command[10] = f'{endTime}%{endTime+interval}'
-        keyEndTime = None
-        while keyEndTime == None:
-            
-            # exec on separate thread
-            def execCommand(event):
-                result = subprocess.run(command, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                event.returnValue = result
-            event = threading.Event()
-            cmdThread = threading.Thread(target=execCommand, args=(event,))
-            cmdThread.start()
-            
-            while cmdThread.is_alive():
-                trimScene.root.update()
-            result = event.returnValue
-
-
-            # clean output
-            output = result.stdout.split('\n')[:-1]
-            cleaned_output = []
-            for line in output:
-                if line != '':
-                    new_line = line.split(",")[0]
-                    cleaned_output.append(new_line)
-            output = cleaned_output
-            
-
-            # get next frame
-            if keyEndTime == None:
-                for frame in output:
-                    if float(frame) >= endTime:
-                        keyEndTime = float(frame)      # keyframe is next, or none if no frames found
-                        break    
-
-            # if not found and out of bounds, not found
-            if keyEndTime == None and endTime + interval > fullVideoLength/1000: 
-                keyEndTime = fullVideoLength/1000
-                break
+def _getAudioCodecs(inputPath: str):
+    """
+        Returns the codec name of each audio track in the file
+    """
+    return probe.getMediaInfo(inputPath)["audioCodecs"]
 
-            # if not found, increase interval
-            interval += 5
-            command[10] = f'{endTime+interval-5}%{endTime+interval}'
+def _getAudioOptions(inputPath: str, profile: dict):
+    """
+        Returns the ffmpeg options that copy the audio if every track already fits an mp4, otherwise encode it with the profile
+    """
+    codecs = _getAudioCodecs(inputPath)
+    if len(codecs) > 0 and all(codec in MP4_AUDIO_CODECS for codec in codecs):
+        return ['-c:a', 'copy']
+    return profiles.getAudioOptions(profile)
 
-        # extract on the corrected times
-        command = ['ffmpeg', '-loglevel', 'quiet', '-i', inputPath, '-ss', str(keyStartTime-.1), '-to', str(keyEndTime+.1), '-c', 'copy', '-map', '0', outputPath]
+def _getSilenceOutput(inputIndex: int, statsPath: str):
+    """
+        Returns the ffmpeg output arguments that write the RMS and peak level of every frame of the alternate audio track to statsPath
+    """
+    escapedPath = statsPath.replace('\\', '/').replace(':', '\\:')      # escaped for use as a filter option
+    return ['-map', f'{inputIndex}:a:1', '-af', f"astats=metadata=1:reset=1:measure_perchannel=none:measure_overall=RMS_level+Peak_level,ametadata=mode=print:file='{escapedPath}'", '-f', 'null', '-']
 
-        # exec on separate thread
-        def execCommand():
-            subprocess.run(command, creationflags=subprocess.CREATE_NO_WINDOW)
-        cmdThread = threading.Thread(target=execCommand)
-        cmdThread.start()
+def _readSilenceStats(statsPath: str):
+    """
+        Returns true if no frame written by the silence output rises above the silence threshold.
+        Returns false if there is no alternate audio track
+    """
+    if statsPath == None or not os.path.exists(statsPath): return False
 
-        while cmdThread.is_alive():
-            if trimScene != None:
-                trimScene.root.update()
+    hasAudio = False
+    with open(statsPath) as file:
+        for line in file:
+            if not line.startswith(("lavfi.astats.Overall.RMS_level=", "lavfi.astats.Overall.Peak_level=")): continue
+            hasAudio = True
+            if float(line.split("=", 1)[1]) > SILENCE_THRESHOLD_DB:
+                return False
+
+    return hasAudio
+
+def _getMatchingVideoOptions(inputPath: str):
+    """
+        Returns the ffmpeg options that encode the default video stream with the codec, profile, level, reference frames and pixel format of the source,
+        or None if it has no smart render encoder or its profile is unknown
+    """
+    info = probe.getMediaInfo(inputPath)
+    codec = info["videoCodec"]
+    encoder = SMART_RENDER_ENCODERS.get(codec)
+    videoProfile = SMART_RENDER_PROFILES.get(codec, dict()).get(info.get("videoProfile"))      # files probed by older versions have no profile
+    if encoder == None or videoProfile == None: return None
+
+    options = ['-c:v', encoder, '-profile:v', videoProfile]
+    if info["pixelFormat"] != None: options += ['-pix_fmt', info["pixelFormat"]]
+
+    level = info.get("videoLevel", 0)
+    if codec == "h264":
+        if level > 0: options += ['-level', "1b" if level == 9 else f"{level // 10}.{level % 10}"]      # stored as 10 times the level
+        if info.get("videoRefs", 0) > 0: options += ['-refs', str(info["videoRefs"])]
+    elif level > 0:
+        options += ['-x265-params', f"level-idc={level / 30:g}"]       # stored as 30 times the level
+    return options
 
 
 
-def checkIsSilent(inputPath: str, startTime: float, endTime: float, trimScene = None):
+def _searchKeyframes(inputPath: str, startTime: float, endTime: float, fullVideoLength: float, trimScene = None):
     """
-        Returns true if the video has no audio (only checks the first 5 seconds)
+        Finds the keyframe at or before startTime and the keyframe at or after endTime.
+        A single ffprobe run reads the keyframe flags of the packets in a window on each side, without decoding any frames.
+        If a side has no keyframe, only that side is read again with a window twice the longest GOP seen.
+        Only used when the keyframe index of the file could not be built
     """
-    command = ['ffmpeg', '-i', inputPath, '-map', '0:a:1?', '-af', 'astats', '-f', 'null', '-ss', str(startTime-1), '-to', str(endTime+1), '-threads', '10', '-']
+    duration = fullVideoLength / 1000
+    window = KEYFRAME_SEARCH_WINDOW
+    keyStartTime = None
+    keyEndTime = None
+    while True:
+        intervals = []
+        if keyStartTime == None: intervals.append(f"{max(0, startTime - window)}%{startTime + .001}")
+        if keyEndTime == None: intervals.append(f"{endTime}%{endTime + window}")
+        command = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',                   # set video stream to default
+            '-show_entries', 'packet=pts_time,flags',   # outputs the timestamp and keyframe flag
+            '-of', 'csv=print_section=0',               # set output format
+            '-read_intervals', ",".join(intervals),     # set time intervals, each read from the keyframe before it
+            str(inputPath)                              # set input file
+        ]
+        result = _runCommand(command, trimScene=trimScene, captureOutput=True)
+        keyframes = _parseKeyframePackets(result.stdout)
 
-    # exec on separate thread
-    def execCommand(event):
-        result = subprocess.run(command, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-        event.returnValue = result.stdout, result.stderr
+        # keyframe is previous, or the start of the video once the window reaches it
+        if keyStartTime == None:
+            previous = [keyframe for keyframe in keyframes if keyframe <= startTime]
+            if len(previous) > 0: keyStartTime = previous[-1]
+            elif startTime - window <= 0: keyStartTime = 0
 
-    # check multiple positions for silence to save time
-    event = threading.Event()
-    cmdThread = threading.Thread(target=execCommand, args=(event,))
-    cmdThread.start()
+        # keyframe is next, or the end of the video once the window reaches it
+        if keyEndTime == None:
+            following = [keyframe for keyframe in keyframes if keyframe >= endTime]
+            if len(following) > 0: keyEndTime = following[0]
+            elif endTime + window >= duration: keyEndTime = duration
 
-    while cmdThread.is_alive():
-        if trimScene != None:
-            trimScene.root.update()
+        if keyStartTime != None and keyEndTime != None:
+            return keyStartTime, keyEndTime
 
-    cmdThread.join()
-    result = event.returnValue
+        # grow the window past the GOP length measured within each window
+        gaps = [later - earlier for earlier, later in zip(keyframes, keyframes[1:]) if (later <= startTime + .001) or (earlier >= endTime)]
+        window = max(window * 2, max(gaps, default=0) * 2)
 
+def _parseKeyframePackets(output: str):
+    """
+        Returns the sorted times of the keyframe packets in the csv output of ffprobe (pts_time,flags per line)
+    """
+    keyframes = set()
+    for line in output.split('\n'):
+        values = line.split(",")
+        if len(values) < 2 or 'K' not in values[1]: continue
+        try:
+            keyframes.add(float(values[0]))
+        except ValueError:
+            continue        # N/A timestamps
 
-    # process results
-    noSound = []
-    data = result[0 if len(result[0]) > 0 else 1].split('\n')
-    for line in data:
-        if line[37::].startswith("RMS level dB"): 
-            if len(line) < 50: return False
-            else: return line[51::] == "-inf"
+    return sorted(keyframes)
+
+
+
+def checkIsSilent(inputPath: str, startTime: float, endTime: float, trimScene = None, thresholdDb: float = SILENCE_THRESHOLD_DB):
+    """
+        Returns true if the alternate audio track of the clip never rises above thresholdDb (RMS or peak per chunk).
+        Audio is streamed from ffmpeg in small chunks and decoding stops as soon as one chunk is loud enough.
+        Returns false if the video has no alternate audio track
+    """
+    with threadBudget.acquire(JOB_DECODE) as threads, tracing.span("checkIsSilent", input=inputPath, startTime=startTime, endTime=endTime):
+        return _checkIsSilent(inputPath, startTime, endTime, trimScene, thresholdDb, threads)
+
+def _checkIsSilent(inputPath: str, startTime: float, endTime: float, trimScene, thresholdDb: float, threads: int):
+    command = [
+        'ffmpeg', '-loglevel', 'quiet',
+        '-threads', str(threads),                   # set decoder thread count
+        '-ss', str(max(0, startTime-1)),            # set start time
+        '-to', str(endTime+1),                      # set end time
+        '-i', str(inputPath),                       # set input file
+        '-map', '0:a:1?',                           # set alternate audio track
+        '-ac', '1',                                 # mix down to mono
+        '-ar', str(SILENCE_SAMPLE_RATE),            # set sample rate
+        '-f', 'f32le', '-'                          # output raw samples
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+
+    threshold = 10 ** (thresholdDb / 20)
+    chunkSize = int(SILENCE_SAMPLE_RATE * SILENCE_CHUNK_DURATION) * 4       # 4 bytes per sample
+    hasAudio = False
+    try:
+        while True:
+            data = process.stdout.read(chunkSize)
+            if not data: break
+
+            samples = np.frombuffer(data, dtype=np.float32, count=len(data) // 4)
+            if samples.size == 0: continue
+            hasAudio = True
+
+            # stop on the first loud chunk, the peak catches clicks too short to raise the RMS
+            rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64)))
+            if rms > threshold or np.max(np.abs(samples)) > threshold:
+                return False
+
+            if trimScene != None:
+                trimScene.root.update()
+    finally:
+        process.kill()
+        process.wait()
 
-    return False
+    return hasAudio
 
 
 
@@ -7,6 +7,10 @@
 import tkinter as tk
 import gui
 import discord
+import probe
+import thumbnails
+import waveform
+import proxies
 import atexit
 
 # create discord presence
@@ -48,4 +52,10 @@ if __name__ == "__main__":
 
     root.mainloop()
 
+    # do not wait on background probes of files that will not be used
+    probe.shutdownPrefetch()
+    thumbnails.shutdown()
+    waveform.shutdown()
+    proxies.shutdown()
+
 
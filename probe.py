@@ -0,0 +1,164 @@
+#
+# probe.py
+#
+# Contains the persistent cache of media metadata, probed once per input file and shared by every stage of the app
+#
+
+import os
+import json
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cache
+from cache import CREATION_FLAGS
+import tracing
+
+# metadata loaded during this session
+_infos = dict()
+_infoLocks = dict()
+_lock = threading.Lock()
+
+# background probes started by prefetchMediaInfo
+_executor = None
+
+
+def getMediaInfo(inputPath: str):
+    """
+        Returns a dict of the file's metadata, probed with ffprobe on first use and read from the cache after that:
+        duration (ms), fps, videoCodec, pixelFormat, videoProfile, videoLevel, videoRefs, width, height, audioCodecs (one per track),
+        audioTracks, videoStreams and error (None, or why the file cannot be trimmed)
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError as e:
+        return _getEmptyInfo(f"file could not be read: {e.strerror}")
+
+    # only one thread probes a given file
+    with _lock:
+        if key in _infos: return _infos[key]
+        infoLock = _infoLocks.setdefault(key, threading.Lock())
+
+    with infoLock:
+        if key in _infos: return _infos[key]
+
+        cachePath = os.path.join(cache.getCacheDir("probe"), f"{key}.json")
+        info = None
+        if os.path.exists(cachePath):
+            try:
+                with open(cachePath, encoding="utf-8") as file:
+                    info = json.load(file)
+            except ValueError:
+                info = None
+        if info == None:
+            try:
+                with tracing.span("probe", input=inputPath):
+                    info = _probe(inputPath)
+            except OSError as e:
+                return _getEmptyInfo(f"ffprobe could not be run: {e}")      # not cached, so it is probed again once fixed
+            cache.writeFileAtomic(cachePath, json.dumps(info).encode("utf-8"))
+
+        with _lock:
+            _infos[key] = info
+        return info
+
+def getCachedMediaInfo(inputPath: str):
+    """
+        Returns the metadata of the file if it was already probed during this session, otherwise None.
+        Never blocks, so it is safe to call from the GUI thread
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError:
+        return None
+    with _lock:
+        return _infos.get(key)
+
+def prefetchMediaInfo(inputPaths: list, maxWorkers: int = 4):
+    """
+        Probes every file on a thread pool, in order.
+        Returns a list of futures of getMediaInfo, one per file
+    """
+    global _executor
+    if _executor == None:
+        _executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="probe")
+
+    return [_executor.submit(getMediaInfo, inputPath) for inputPath in inputPaths]
+
+def shutdownPrefetch():
+    """
+        Cancels the background probes that have not started yet
+    """
+    global _executor
+    if _executor != None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _probe(inputPath: str):
+    """
+        Reads the format and streams of the file with a single ffprobe run
+    """
+    info = _getEmptyInfo()
+
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration:stream=codec_type,codec_name,profile,level,refs,pix_fmt,width,height,avg_frame_rate,r_frame_rate,duration',
+        '-of', 'json',
+        str(inputPath)
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, creationflags=CREATION_FLAGS)
+    if result.returncode != 0:
+        info["error"] = result.stderr.strip().split("\n")[-1] or f"ffprobe exited with code {result.returncode}"
+        return info
+
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        info["error"] = "ffprobe output could not be read"
+        return info
+
+    streams = data.get("streams", [])
+    videoStreams = [stream for stream in streams if stream.get("codec_type") == "video"]
+    audioStreams = [stream for stream in streams if stream.get("codec_type") == "audio"]
+    info["videoStreams"] = len(videoStreams)
+    info["audioCodecs"] = [stream.get("codec_name") for stream in audioStreams]
+    info["audioTracks"] = len(audioStreams)
+
+    if len(videoStreams) > 0:
+        video = videoStreams[0]
+        info["videoCodec"] = video.get("codec_name")
+        info["pixelFormat"] = video.get("pix_fmt")
+        info["videoProfile"] = video.get("profile")
+        info["videoLevel"] = int(video.get("level") or 0)
+        info["videoRefs"] = int(video.get("refs") or 0)
+        info["width"] = int(video.get("width") or 0)
+        info["height"] = int(video.get("height") or 0)
+        info["fps"] = _parseRate(video.get("avg_frame_rate")) or _parseRate(video.get("r_frame_rate"))
+
+    duration = data.get("format", {}).get("duration") or (videoStreams[0].get("duration") if len(videoStreams) > 0 else None)
+    try:
+        info["duration"] = float(duration) * 1000
+    except (TypeError, ValueError):
+        info["duration"] = 0
+
+    if len(videoStreams) == 0:
+        info["error"] = "no video stream"
+    elif info["videoCodec"] == None:
+        info["error"] = "unsupported video codec"
+    elif info["duration"] <= 0:
+        info["error"] = "unknown duration, the file may be truncated"
+
+    return info
+
+def _getEmptyInfo(error: str = None):
+    return dict(duration=0, fps=0, videoCodec=None, pixelFormat=None, videoProfile=None, videoLevel=0, videoRefs=0, width=0, height=0, audioCodecs=[], audioTracks=0, videoStreams=0, error=error)
+
+def _parseRate(rate: str):
+    """
+        Returns the frame rate of an ffprobe fraction such as 30000/1001, or 0 if unknown
+    """
+    try:
+        numerator, denominator = (rate or "0/0").split("/")
+        return float(numerator) / float(denominator) if float(denominator) != 0 else 0
+    except ValueError:
+        return 0
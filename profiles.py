@@ -0,0 +1,73 @@
+#
+# profiles.py
+#
+# Contains the named encoder profiles used by re-encoded trims and a benchmark of encoder presets on this machine
+#
+
+import os
+import subprocess
+import tempfile
+import time
+from cache import CREATION_FLAGS
+
+ENCODER_PROFILES = {
+    "Quality": {"videoCodec": "libx264", "preset": "medium", "crf": 15, "audioCodec": "libmp3lame", "audioBitrate": "320k"},
+    "Balanced": {"videoCodec": "libx264", "preset": "fast", "crf": 17, "audioCodec": "aac", "audioBitrate": "256k"},
+    "Fast": {"videoCodec": "libx264", "preset": "veryfast", "crf": 18, "audioCodec": "aac", "audioBitrate": "192k"},
+    "Small (HEVC)": {"videoCodec": "libx265", "preset": "medium", "crf": 20, "audioCodec": "aac", "audioBitrate": "192k"},
+}
+DEFAULT_PROFILE = "Quality"
+
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+
+def getEncoderProfile(name: str = None):
+    """
+        Returns the settings of the named profile, or of the default profile if the name is unknown
+    """
+    return ENCODER_PROFILES.get(name, ENCODER_PROFILES[DEFAULT_PROFILE])
+
+def getVideoOptions(profile: dict):
+    """
+        Returns the ffmpeg output options that encode video with the profile
+    """
+    return [
+        '-c:v', profile["videoCodec"],      # set video codec
+        '-crf', str(profile["crf"]),        # set quality (0=lossless)
+        '-preset', profile["preset"]        # set encoding time to file size ratio
+    ]
+
+def getAudioOptions(profile: dict):
+    """
+        Returns the ffmpeg output options that encode audio with the profile
+    """
+    return [
+        '-c:a', profile["audioCodec"],      # set audio codec
+        '-b:a', profile["audioBitrate"]     # set audio bitrate
+    ]
+
+def calibratePresets(presets: list = X264_PRESETS, videoCodec: str = "libx264", crf: int = 15, duration: int = 10, size: str = "1920x1080", rate: int = 30):
+    """
+        Encodes the same synthetic clip with each preset on this machine.
+        Returns a list of dicts of preset, seconds, fps and bytes (size of the output)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tempDir:
+        for preset in presets:
+            outputPath = os.path.join(tempDir, f"{preset}.mp4")
+            command = [
+                'ffmpeg', '-loglevel', 'error', '-y',
+                '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}:duration={duration}',       # moving synthetic video
+                '-c:v', videoCodec, '-crf', str(crf), '-preset', preset,
+                outputPath
+            ]
+
+            start = time.perf_counter()
+            result = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+            seconds = time.perf_counter() - start
+            if result.returncode != 0:
+                raise Exception(f"Encoding with preset {preset} failed: {result.stderr.strip()}")
+
+            results.append(dict(preset=preset, seconds=seconds, fps=duration * rate / seconds, bytes=os.path.getsize(outputPath)))
+
+    return results
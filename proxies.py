@@ -0,0 +1,146 @@
+#
+# proxies.py
+#
+# Contains the low resolution, all-intra proxies played in place of heavy inputs so that seeking only decodes a single frame
+#
+
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cache
+from cache import CREATION_FLAGS
+import probe
+
+PROXY_HEIGHT = 540
+HEAVY_HEIGHT = 1440                     # taller inputs always get a proxy
+HEAVY_CODECS = ("hevc", "av1")          # costly to decode at any resolution
+CACHE_LIMIT = 20 * 1024**3              # oldest proxies are removed past this many bytes
+
+# proxies built during this session, None for inputs that do not need one
+_proxies = dict()
+_pending = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="proxies")     # one file at a time, playback keeps the rest of the cpu
+_process = None                         # running ffmpeg, stopped by shutdown
+
+
+def isHeavy(info: dict):
+    """
+        Returns True if the probed file is slow enough to seek in to be played from a proxy
+    """
+    if info["error"] != None: return False
+    return info["height"] > HEAVY_HEIGHT or info["videoCodec"] in HEAVY_CODECS
+
+def getCachedProxy(inputPath: str):
+    """
+        Returns the path of the file's proxy if it is built, otherwise starts building it in the background and returns None.
+        Also returns None for files that do not need a proxy. Never blocks, so it is safe to call from the GUI thread
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError:
+        return None
+
+    with _lock:
+        if key in _proxies: return _proxies[key]
+        if key in _pending: return None
+        _pending.add(key)
+
+    # already built by a previous session
+    proxyPath = _getCachePath(key)
+    if os.path.exists(proxyPath):
+        with _lock:
+            _proxies[key] = proxyPath
+            _pending.discard(key)
+        return proxyPath
+
+    _executor.submit(_loadProxy, inputPath, key)
+    return None
+
+def prefetchProxies(inputPaths: list):
+    """
+        Queues the proxies of every file, built in order
+    """
+    for inputPath in inputPaths:
+        getCachedProxy(inputPath)
+
+def shutdown():
+    """
+        Cancels the proxies that have not started building yet and stops the one being built
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
+    with _lock:
+        if _process != None and _process.poll() == None:
+            _process.kill()
+
+def _loadProxy(inputPath: str, key: str):
+    try:
+        info = probe.getMediaInfo(inputPath)
+        proxyPath = _buildProxy(inputPath, key) if isHeavy(info) else None
+    except Exception as e:
+        print(f"Could not create a proxy of [{inputPath}]: {e}")
+        proxyPath = None
+
+    with _lock:
+        _proxies[key] = proxyPath       # None is kept as well, so a failing file is not retried on every open
+        _pending.discard(key)
+
+def _buildProxy(inputPath: str, key: str):
+    """
+        Transcodes the first video track to a small all-intra stream, keeping every audio track so the alternate track still plays
+    """
+    global _process
+    proxyPath = _getCachePath(key)
+    tempPath = f"{proxyPath}.{os.getpid()}.tmp.mkv"
+    command = [
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-i', str(inputPath),
+        '-map', '0:v:0', '-map', '0:a?',
+        '-sn', '-dn',
+        '-vf', f'scale=-2:{PROXY_HEIGHT}',
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-tune', 'fastdecode',
+        '-g', '1',                      # every frame is a keyframe
+        '-crf', '28',
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'copy',
+        '-threads', '2',
+        tempPath
+    ]
+    with _lock:
+        _process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, creationflags=CREATION_FLAGS)
+        process = _process
+    _, stderr = process.communicate()
+    with _lock:
+        _process = None
+
+    if process.returncode != 0 or not os.path.exists(tempPath):
+        if os.path.exists(tempPath): os.remove(tempPath)
+        raise Exception(stderr.strip() or f"ffmpeg exited with code {process.returncode}")
+    os.replace(tempPath, proxyPath)
+
+    _pruneCache(proxyPath)
+    return proxyPath
+
+def _pruneCache(keepPath: str):
+    """
+        Removes the least recently built proxies until the folder is within CACHE_LIMIT
+    """
+    directory = cache.getCacheDir("proxies")
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".mkv") and ".tmp" not in name]
+    paths.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(path) for path in paths)
+    for path in paths:
+        if total <= CACHE_LIMIT: break
+        if path == keepPath: continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)             # fails while the player has it open, it is removed next time
+            total -= size
+        except OSError:
+            pass
+
+def _getCachePath(key: str):
+    return os.path.join(cache.getCacheDir("proxies"), f"{key}.mkv")
@@ -0,0 +1,147 @@
+#
+# thumbnails.py
+#
+# Contains the seek bar preview thumbnails, extracted from keyframes into a sprite sheet cached per input file
+#
+
+import os
+import json
+import math
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import cache
+from cache import CREATION_FLAGS
+import probe
+
+THUMBNAIL_WIDTH = 160
+SHEET_COLUMNS = 10
+MAX_THUMBNAILS = 300        # long files space thumbnails further apart instead
+MIN_INTERVAL = 2            # seconds between thumbnails of short files
+
+# sprite sheets loaded during this session
+_sheets = dict()
+_pending = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")     # one file at a time, playback keeps the rest of the cpu
+
+
+class SpriteSheet():
+    """
+        A grid of thumbnails taken every interval seconds of a video
+    """
+    def __init__(self, image: Image.Image, interval: float, count: int, columns: int, tileWidth: int, tileHeight: int):
+        self.image = image
+        self.interval = interval
+        self.count = count
+        self.columns = columns
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+
+    def getIndex(self, time: float):
+        """
+            Returns the index of the thumbnail nearest to the time (in seconds)
+        """
+        return max(0, min(self.count - 1, round(time / self.interval)))
+
+    def getThumbnail(self, index: int):
+        """
+            Returns the thumbnail at the index as a PIL image
+        """
+        x = (index % self.columns) * self.tileWidth
+        y = (index // self.columns) * self.tileHeight
+        return self.image.crop((x, y, x + self.tileWidth, y + self.tileHeight))
+
+
+
+def getCachedSpriteSheet(inputPath: str):
+    """
+        Returns the sprite sheet of the file if it is loaded, otherwise starts building it in the background and returns None.
+        Never blocks, so it is safe to call from the GUI thread
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError:
+        return None
+
+    with _lock:
+        if key in _sheets: return _sheets[key]
+        if key in _pending: return None
+        _pending.add(key)
+
+    _executor.submit(_loadSpriteSheet, inputPath, key)
+    return None
+
+def shutdown():
+    """
+        Cancels the sprite sheets that have not started building yet
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+def _loadSpriteSheet(inputPath: str, key: str):
+    try:
+        sheet = _readSpriteSheet(key)
+        if sheet == None:
+            sheet = _buildSpriteSheet(inputPath, key)
+    except Exception as e:
+        print(f"Could not create thumbnails of [{inputPath}]: {e}")
+        sheet = None
+
+    with _lock:
+        _sheets[key] = sheet        # None is kept as well, so a failing file is not retried on every hover
+        _pending.discard(key)
+
+def _readSpriteSheet(key: str):
+    imagePath, metaPath = _getCachePaths(key)
+    if not os.path.exists(imagePath) or not os.path.exists(metaPath): return None
+
+    with open(metaPath, encoding="utf-8") as file:
+        meta = json.load(file)
+    image = Image.open(imagePath)
+    image.load()
+    return SpriteSheet(image, **meta)
+
+def _buildSpriteSheet(inputPath: str, key: str):
+    """
+        Decodes only the keyframes of the file and tiles one every interval seconds into a single image
+    """
+    info = probe.getMediaInfo(inputPath)
+    if info["error"] != None:
+        raise Exception(info["error"])
+
+    duration = info["duration"] / 1000
+    interval = max(MIN_INTERVAL, duration / MAX_THUMBNAILS)
+    count = math.ceil(duration / interval) + 1
+    rows = math.ceil(count / SHEET_COLUMNS)
+    tileHeight = max(2, round(THUMBNAIL_WIDTH * info["height"] / max(1, info["width"]) / 2) * 2)
+
+    imagePath, metaPath = _getCachePaths(key)
+    tempPath = f"{imagePath}.{os.getpid()}.tmp.jpg"
+    command = [
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-skip_frame', 'nokey',                     # only decode keyframes
+        '-i', str(inputPath),
+        '-an', '-sn',
+        '-vf', f'fps=1/{interval},scale={THUMBNAIL_WIDTH}:{tileHeight},tile={SHEET_COLUMNS}x{rows}',
+        '-frames:v', '1',
+        '-q:v', '5',
+        '-threads', '2',
+        tempPath
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, creationflags=CREATION_FLAGS)
+    if result.returncode != 0 or not os.path.exists(tempPath):
+        if os.path.exists(tempPath): os.remove(tempPath)
+        raise Exception(result.stderr.strip() or f"ffmpeg exited with code {result.returncode}")
+    os.replace(tempPath, imagePath)
+
+    meta = dict(interval=interval, count=count, columns=SHEET_COLUMNS, tileWidth=THUMBNAIL_WIDTH, tileHeight=tileHeight)
+    cache.writeFileAtomic(metaPath, json.dumps(meta).encode("utf-8"))
+
+    image = Image.open(imagePath)
+    image.load()
+    return SpriteSheet(image, **meta)
+
+def _getCachePaths(key: str):
+    directory = cache.getCacheDir("thumbnails")
+    return os.path.join(directory, f"{key}.jpg"), os.path.join(directory, f"{key}.json")
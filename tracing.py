@@ -0,0 +1,96 @@
+#
+# tracing.py
+#
+# Contains the optional timeline of trim jobs, saved as Chrome trace-event JSON that opens in chrome://tracing or ui.perfetto.dev
+#
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# args passed down from a span to the spans started within it on the same thread
+INHERITED_ARGS = ["jobIds", "input"]
+
+_events = []
+_threadIds = set()          # threads whose name was recorded
+_lock = threading.Lock()
+_context = threading.local()
+_isEnabled = False
+_startTime = 0
+
+
+def start():
+    """
+        Starts recording spans, discarding any previous recording
+    """
+    global _isEnabled, _startTime
+    with _lock:
+        _events.clear()
+        _threadIds.clear()
+        _startTime = time.perf_counter()
+        _isEnabled = True
+
+def stop(outputPath: str = None):
+    """
+        Stops recording and writes the recorded spans to outputPath if given.
+        Returns the number of spans recorded
+    """
+    global _isEnabled
+    with _lock:
+        _isEnabled = False
+        events = list(_events)
+
+    if outputPath != None:
+        with open(outputPath, "w", encoding="utf-8") as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), file, default=str)
+    return sum(1 for event in events if event["ph"] == "X")
+
+def isEnabled():
+    return _isEnabled
+
+@contextmanager
+def span(name: str, category: str = "trim", **args):
+    """
+        Records the time spent in the block as a span of the calling thread.
+        Yields the args of the span, so values known at the end (such as bytes written) can be added to them.
+        Does nothing but yield an unused dict when not recording
+    """
+    if not _isEnabled:
+        yield dict()
+        return
+
+    parentArgs = getattr(_context, "args", dict())
+    spanArgs = dict(parentArgs)
+    spanArgs.update(args)
+    _context.args = dict((key, spanArgs[key]) for key in INHERITED_ARGS if key in spanArgs)
+
+    startTime = time.perf_counter()
+    try:
+        yield spanArgs
+    except BaseException as e:
+        spanArgs["error"] = str(e)
+        raise
+    finally:
+        endTime = time.perf_counter()
+        _context.args = parentArgs
+        _record(name, category, startTime, endTime, spanArgs)
+
+def _record(name: str, category: str, startTime: float, endTime: float, args: dict):
+    thread = threading.current_thread()
+    with _lock:
+        if not _isEnabled: return
+
+        # name the row of each worker in the viewer
+        if thread.ident not in _threadIds:
+            _threadIds.add(thread.ident)
+            _events.append(dict(name="thread_name", ph="M", pid=os.getpid(), tid=thread.ident, args=dict(name=thread.name)))
+
+        _events.append(dict(
+            name=name, cat=category, ph="X",
+            ts=(startTime - _startTime) * 1000000,      # microseconds
+            dur=(endTime - startTime) * 1000000,
+            pid=os.getpid(), tid=thread.ident,
+            args=args
+        ))
@@ -14,22 +14,45 @@ except:pass
 
 import tkinter as tk
 import vlc
-import threading
+import numpy as np
 import time
+import queue
+from collections import OrderedDict
 from PIL import Image, ImageTk
 import gui
+import probe
+import thumbnails
+import waveform
+import proxies
+import frames
+import keyframes as keyframeIndex
 
 WINDOW_HEIGHT = 649
 WINDOW_WIDTH = 1024
+PRELOADED_MEDIA = 4         # parsed media objects kept ready for the neighbouring videos
+PLAYING_UPDATE_INTERVAL = 15    # ms between redraws while playing
+IDLE_UPDATE_INTERVAL = 100      # ms between checks for player events while paused
+
+# player events forwarded from vlc's threads to the tk thread
+PLAYER_EVENTS = [
+    vlc.EventType.MediaPlayerPlaying,
+    vlc.EventType.MediaPlayerPaused,
+    vlc.EventType.MediaPlayerStopped,
+    vlc.EventType.MediaPlayerEndReached,
+    vlc.EventType.MediaPlayerTimeChanged,
+    vlc.EventType.MediaPlayerLengthChanged,
+    vlc.EventType.MediaPlayerESAdded
+]
 
 
 
 
 class VideoPlayer(tk.Frame):
-    def __init__(self, parent, root, playOnOpen: bool, restrictLeftButton = None, restrictRightButton = None, unrestrictLeftButton = None, unrestrictRightButton = None, clipScene = None, menuBar = None, discordPresence = None, mainApp = None):
+    def __init__(self, parent, root, playOnOpen: bool, useProxies: bool = False, restrictLeftButton = None, restrictRightButton = None, unrestrictLeftButton = None, unrestrictRightButton = None, clipScene = None, menuBar = None, discordPresence = None, mainApp = None):
         """
             Params:
             playOnOpen: autoplay automatically upon opening a video using openVideo()
+            useProxies: play the low resolution proxy of heavy videos once it is built
         """
         super().__init__(parent, bg="#000000")
         self.grid_rowconfigure(0, weight=1)
@@ -38,10 +61,12 @@ class VideoPlayer(tk.Frame):
         self.parent = parent
         self.lastVolumeChange = 0  
         self.isVolumeBarVisible = False
-        self.lastEndStateTime = 0
-        self.timeToUpdateEndState = 1
         self.duration = 0
+        self.filepath = None
+        self.playbackPath = None        # file given to vlc, the proxy of filepath if one is used
         self.isVideoOpened = False
+        self.isOpening = False          # the opened video has not started playing yet
+        self.openCallbacks = []         # called once the opened video plays
         self.enableRestrictedPlayback = False
         self.restrictLeft = None
         self.restrictRight = None
@@ -57,11 +82,23 @@ class VideoPlayer(tk.Frame):
 
         # properties
         self.playOnOpen = playOnOpen
+        self.useProxies = useProxies
         self.volume = 50
 
         # init vlc instance
         self.instance = vlc.Instance()
         self.player = self.instance.media_player_new()
+        self.preloader = MediaPreloader(self.instance)
+
+        # player state, only written on the tk thread from player events
+        self.events = queue.Queue()
+        self.isPlaying = False
+        self.lastTime = 0               # ms, last time reported by the player or set by a seek
+        self.lastTimeUpdate = 0         # when lastTime was set, to estimate the time between reports while playing
+        self.playerLength = 0
+        self.eventManager = self.player.event_manager()        # kept referenced, vlc calls back through it
+        for eventType in PLAYER_EVENTS:
+            self.eventManager.event_attach(eventType, self._onPlayerEvent)
         self.player.video_set_mouse_input(False)
         self.player.video_set_key_input(False)
         
@@ -89,6 +126,13 @@ class VideoPlayer(tk.Frame):
 
         self.progressBar.place(x=0, y=self.canvas.winfo_height())      
 
+        # decoded frames drawn over the player while stepping frame by frame
+        self.frameDecoder = frames.FrameDecoder()
+        self.frameView = tk.Label(self, bg="black", borderwidth=0)
+        self.frameImage = None
+        self.frameIndex = None          # index in the decoder's ring of the frame shown, None when not stepping
+        self.frameTime = None           # ms, exact time of the frame shown
+
         # buttons
         padX = 5
         self.volumeBar = VolumeBar(self, player=self.player, defaultVolume=50, width=19, height=50)
@@ -129,11 +173,17 @@ class VideoPlayer(tk.Frame):
         self.progressBar.canvas.config(width=self.progressBar.width)
         self.progressBar.place(x=0, y=self.canvas.winfo_height() - (self.progressBarHeight if self.bFullscreen.isFullscreen else 0))      
 
+        # volume bar
+        self.isVolumeBarVisible = None      # placed again on the next update
+
+        # shown frame no longer fits
+        self.hideFrame()
+
     def onClick(self, event):
         """
             On click anywhere in the window
         """
-        if event.widget != self.canvas: return
+        if event.widget not in [self.canvas, self.frameView]: return
         self.parent.update_idletasks()  # update focus
         def _afterFocus():
             if not self.isWindowFocused: return       # only check when the window is focused
@@ -198,9 +248,17 @@ class VideoPlayer(tk.Frame):
             if self.player.get_length() == 0: return
             leftPercent = self.restrictLeft / self.player.get_length()
             rightPercent = self.restrictRight / self.player.get_length()
-            self.player.set_position(leftPercent if percent < leftPercent else (rightPercent if percent > rightPercent else percent))
-        else:
-            self.player.set_position(percent)
+            percent = leftPercent if percent < leftPercent else (rightPercent if percent > rightPercent else percent)
+        self.hideFrame(isSeeking=False)
+        self.player.set_position(percent)
+        self._setKnownTime(percent * self.player.get_length())
+
+    def _setKnownTime(self, newTime: float):
+        """
+            Records the time (ms) the player was moved to, so the display follows before the player reports it
+        """
+        self.lastTime = newTime
+        self.lastTimeUpdate = time.time()
 
     def onKeyPress(self, event):
         key = event.keysym
@@ -230,14 +288,10 @@ class VideoPlayer(tk.Frame):
             self.lastVolumeChange = time.time()
         elif key == "period":
             if self.bPause.isPaused and self.player.get_state() != vlc.State.Ended:
-                fps = self.player.get_fps()
-                duration = int(1000 / fps)       # number of ms per frame
-                self.seek(duration)
+                self.stepFrame(1)
         elif key == "comma":
             if self.bPause.isPaused and self.player.get_state() != vlc.State.Ended:
-                fps = self.player.get_fps()
-                duration = int(1000 / fps)       # number of ms per frame
-                self.seek(-duration)
+                self.stepFrame(-1)
         elif key in ["m","M"]:
             self.actionBar.bVolume.toggleMute()
         elif key in ["f","F"]:
@@ -298,7 +352,9 @@ class VideoPlayer(tk.Frame):
 
                 self._setPlayerPosition(percent)
             else:
+                self.hideFrame(isSeeking=False)
                 self.player.set_time(int(self.duration * percent))
+                self._setKnownTime(int(self.duration * percent))
         elif key in ["e","E"] and event.state == 8:
             self.restrictLeftButton.onClick()
         elif key in ["r","R"] and event.state == 8:
@@ -323,7 +379,83 @@ class VideoPlayer(tk.Frame):
             else:
                 self.clipScene.footerBar.descBar.isBoxFocused = True
                 self.clipScene.footerBar.descBar.box.focus()       # focus on description box
-        
+
+
+    def stepFrame(self, step: int):
+        """
+            Moves the paused video by the given number of frames.
+            The frames around the playhead are decoded once and drawn over the player, so stepping through them is a lookup.
+            Outside of them the player is seeked and the frames around where it lands are decoded
+        """
+        if self.filepath == None: return
+        info = probe.getCachedMediaInfo(self.filepath)
+        fps = info["fps"] if info != None and info["fps"] > 0 else self.player.get_fps()
+        if fps <= 0: return
+        frameDuration = 1 / fps
+        currentTime = (self.frameTime if self.frameTime != None else self.getEstimatedTime()) / 1000
+
+        ring = self.frameDecoder.getRing(self.filepath)
+        index = self.frameIndex
+        if index == None and ring != None:
+            index = ring.find(currentTime, frameDuration)
+        if index != None and 0 <= index + step < len(ring):
+            newTime = ring.getTime(index + step) * 1000
+            if self.enableRestrictedPlayback and not self.restrictLeft <= newTime <= self.restrictRight: return
+            self._showFrame(ring, index + step)
+            return
+
+        # not decoded yet, seek the player by a frame
+        newTime = max(0, currentTime + step * frameDuration)
+        if self.playerLength <= 0: return
+        self._setPlayerPosition(min(1, newTime * 1000 / self.playerLength))
+        if not (self.frameDecoder.isDecoding and self.frameDecoder.isCovering(self.filepath, newTime)):
+            self.frameDecoder.decode(self.filepath, newTime, fps, *self._getFrameSize(info))
+
+    def _showFrame(self, ring: frames.FrameRing, index: int):
+        """
+            Draws the decoded frame over the player.
+            The player is only moved to the frame once it is hidden, so stepping never waits on a seek
+        """
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        image = Image.fromarray(ring.getFrame(index))
+        scale = min(width / image.width, height / image.height)
+        if scale > 0 and scale != 1:
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.BILINEAR)
+        self.frameImage = ImageTk.PhotoImage(image)
+        self.frameView.config(image=self.frameImage)
+        self.frameView.place(x=0, y=0, width=width, height=height)
+        self.frameView.lift()
+        self.progressBar.lift()
+        self.volumeBar.lift()
+
+        self.frameIndex = index
+        self.frameTime = ring.getTime(index) * 1000
+        self._setKnownTime(self.frameTime)
+
+    def hideFrame(self, isSeeking: bool = True):
+        """
+            Stops showing a decoded frame, the player is shown again.
+            The player is seeked to the frame first unless isSeeking is unset, for callers that move it elsewhere
+        """
+        if self.frameIndex == None: return
+        if isSeeking: self.player.set_time(int(self.frameTime))     # playing resumes from the frame
+        self.frameIndex = None
+        self.frameTime = None
+        self.frameView.place_forget()
+
+    def getFrameTime(self):
+        """
+            Returns the exact time (ms) of the frame stepped to, or None if the player is not showing a decoded frame
+        """
+        return self.frameTime
+
+    def _getFrameSize(self, info: dict):
+        """
+            Returns the even width and height decoded frames are scaled to, fitting the player without exceeding MAX_FRAME_WIDTH
+        """
+        width = min(frames.MAX_FRAME_WIDTH, max(2, self.canvas.winfo_width()))
+        aspect = info["height"] / info["width"] if info != None and info["width"] > 0 else 9 / 16
+        return max(2, width // 2 * 2), max(2, round(width * aspect / 2) * 2)
 
     def seek(self, time):
         """
@@ -371,33 +503,83 @@ class VideoPlayer(tk.Frame):
             return
 
         # reset values
-        self.lastEndStateTime = 0
+        self.hideFrame(isSeeking=False)
+        self.frameDecoder.reset()
         self.duration = 0
-
-        media = self.instance.media_new(filepath)
+        self.filepath = filepath
+        thumbnails.getCachedSpriteSheet(filepath)      # start building the seek previews
+        waveform.getCachedPeaks(filepath)
+
+        # previews, keyframes and durations stay those of the original, only playback uses the proxy
+        self.playbackPath = filepath
+        if self.useProxies:
+            proxyPath = proxies.getCachedProxy(filepath)
+            if proxyPath != None and os.path.exists(proxyPath):
+                self.playbackPath = proxyPath
+
+        media = self.preloader.get(self.playbackPath)
         self.player.set_media(media)
         self.player.set_hwnd(self.canvas.winfo_id())
         
-        # Load thumbnail
-        self.play()
-        while not self.player.is_playing(): pass
-        self.pause() 
-        
-        # update position and duration
-        self.player.set_position(0)
-        self.actionBar.playbackTimer.setDuration(self.player.get_length() / 1000)
-        self.duration = self.player.get_length()
-        
-        # play if set to autoplay on open
-        if self.playOnOpen: self.play()
+        # play to show the first frame, the open is finished by the playing event (see _finishOpening)
+        self.isOpening = True
+        self.openCallbacks = []
+        self._setKnownTime(0)
+        self.playerLength = 0
+        self.player.play()
+        self.bPause.isPaused = not self.playOnOpen
+        self.bPause.bPause.config(image=self.bPause.playImage if self.bPause.isPaused else self.bPause.pauseImage)
+
+        # prefer the duration probed by ffmpeg, which is also used to trim
+        info = probe.getCachedMediaInfo(filepath)
+        if info != None and info["duration"] > 0:
+            self.duration = info["duration"]
+
+        # update discord presence
+        if self.discordPresence is not None and self.clipScene != None:
+            try:
+                self.discordPresence.updateStatus(details="Clipping videos", state=f"{min(self.clipScene.currentVideo, self.clipScene.totalVideos)} of {self.clipScene.totalVideos}") 
+            except:
+                self.discordPresence = None     # discord was likely closed
+
+
+    def _finishOpening(self):
+        """
+            Called on the tk thread once the opened video plays, its first frame is shown and its length is known
+        """
+        self.isOpening = False
+        if not self.playOnOpen:
+            self.player.set_pause(1)        # stay on the first frame
+            self.bPause.bPause.config(image=self.bPause.playImage)
+
+        self.playerLength = self.player.get_length()
+        self.actionBar.playbackTimer.setDuration(self.playerLength / 1000)
+        if self.duration == 0: self.duration = self.playerLength
 
         self.isVideoOpened = True
         self.unrestrictPlayback()
 
-        # update options
-        if self.clipScene != None:
-            self.clipScene.updateOptions()
+        callbacks = self.openCallbacks
+        self.openCallbacks = []
+        for callback in callbacks:
+            callback()
 
+    def whenOpened(self, callback):
+        """
+            Calls the callback once the opened video plays, or now if it already does
+        """
+        if self.isOpening:
+            self.openCallbacks.append(callback)
+        else:
+            callback()
+
+    def preloadVideos(self, filepaths: list):
+        """
+            Parses the given videos in the background so that opening them later is quick
+        """
+        for filepath in filepaths:
+            proxyPath = proxies.getCachedProxy(filepath) if self.useProxies else None
+            self.preloader.preload(filepath, proxyPath if proxyPath != None and os.path.exists(proxyPath) else filepath)
 
     def play(self):
         self.bPause.setUnpaused()
@@ -406,45 +588,103 @@ class VideoPlayer(tk.Frame):
         self.bPause.setPaused()
 
     def scheduleUpdates(self):
-        updater = threading.Thread(target=self._update, daemon=True)
-        updater.start()
+        self.after(0, self._update)
+
+    def _onPlayerEvent(self, event):
+        """
+            Called on vlc's threads, only queues the event for the tk thread
+        """
+        value = None
+        if event.type == vlc.EventType.MediaPlayerTimeChanged: value = event.u.new_time
+        elif event.type == vlc.EventType.MediaPlayerLengthChanged: value = event.u.new_length
+        self.events.put((event.type, value))
+
+    def _handlePlayerEvent(self, eventType, value):
+        if eventType == vlc.EventType.MediaPlayerTimeChanged:
+            self._setKnownTime(value)
+        elif eventType == vlc.EventType.MediaPlayerLengthChanged:
+            self.playerLength = value
+            self.actionBar.playbackTimer.setDuration(value / 1000)
+        elif eventType == vlc.EventType.MediaPlayerPlaying:
+            self.isPlaying = True
+            self.hideFrame()
+            self._setKnownTime(self.lastTime)
+            self.bPause.bPause.config(image=self.bPause.pauseImage)
+            if self.isOpening: self._finishOpening()
+        elif eventType == vlc.EventType.MediaPlayerPaused:
+            self.isPlaying = False
+            self._setKnownTime(self.player.get_time())
+            self.bPause.bPause.config(image=self.bPause.playImage)
+        elif eventType == vlc.EventType.MediaPlayerStopped:
+            self.isPlaying = False
+            self._setKnownTime(0)
+        elif eventType == vlc.EventType.MediaPlayerEndReached:
+            self.isPlaying = False
+            self._setKnownTime(self.playerLength)
+            self.bPause.setPaused()
+
+        # audio tracks can only be selected once the player has them
+        if eventType in [vlc.EventType.MediaPlayerPlaying, vlc.EventType.MediaPlayerESAdded] and self.clipScene != None:
+            self.clipScene.updateOptions()
+
+    def getEstimatedTime(self):
+        """
+            Returns the playback time (ms), advanced from the last report of the player while playing
+        """
+        if not self.isPlaying: return self.lastTime
+        return min(self.playerLength, self.lastTime + (time.time() - self.lastTimeUpdate) * 1000)     # playback rate is never changed
 
     def _update(self):
         """
-            Initializes constant updates to elements over an interval
+            Applies queued player events and redraws elements whose value changed.
+            Runs on the tk thread, often while playing and rarely while paused
         """
-        # Get the VLC player position and duration
-        position = self.player.get_position()
-        duration = self.player.get_length()
+        while True:
+            try:
+                eventType, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self._handlePlayerEvent(eventType, value)
 
-        # update last ended video time
-        if self.player.get_state() == vlc.State.Ended:
-            self.lastEndStateTime = time.time()
-        timeSinceLastEndState = time.time() - self.lastEndStateTime
+        duration = self.playerLength
+        currentTime = self.getEstimatedTime()
 
         # pause/loop if at end of video
-        framesToEnd = duration - self.player.get_time()
-        if self.player.get_state() == vlc.State.Playing and framesToEnd < 250:
-            if self.clipScene != None:
-                if self.clipScene.options["LoopPlayback"].get():
-                    self._setPlayerPosition(0)
-                else:
-                    self.player.pause()
+        if self.isPlaying and duration - currentTime < 250:
+            if self.clipScene != None and self.clipScene.options["LoopPlayback"].get():
+                self._setPlayerPosition(0)
             else:
                 self.player.pause()
+                self.isPlaying = False      # pause toggles, do not call it again before the player reports it
 
-        # update pause button
-        playState = self.player.get_state()
-        if playState == vlc.State.Ended:
-            self.bPause.setPaused()
-        elif playState == vlc.State.Playing:
-            self.bPause.bPause.config(image=self.bPause.pauseImage)
-        elif playState == vlc.State.Paused:
-            self.bPause.bPause.config(image=self.bPause.playImage)
-
-        # update progress bar
-        if timeSinceLastEndState > self.timeToUpdateEndState or position != 0:       # do not update on restart video
-            self.progressBar.setValue(1 if playState == vlc.State.Ended else position)
+        # pause if in restricted mode and past boundary
+        # or replay in autoplay mode
+        if duration != 0 and self.enableRestrictedPlayback and round(currentTime, 6) > round(self.restrictRight, 6):
+            if self.clipScene.options["LoopPlayback"].get():
+                if not self.progressBar.isClicking and not self.bPause.isPaused:
+                    self._setPlayerPosition(0)
+            else:
+                if not self.bPause.isPaused: 
+                    self.bPause.togglePause() 
+                
+                if self.clipScene.framePerfectButton.isSet.get() == 1:
+                    # delay needed to process recent pause
+                    self.parent.after(50, lambda: self._setPlayerPosition(self.restrictRight / duration))    
+                    self._setKnownTime(self.restrictRight)
+                else:
+                    self._setPlayerPosition(self.restrictRight / duration)
+                currentTime = self.lastTime
+
+        # update progress bar and timer, both only redraw when their value changes
+        if duration > 0:
+            self.progressBar.setValue(currentTime / duration)
+        self.progressBar.updateWaveform()
+        self.progressBar.updateKeyframes()
+        if self.isVideoOpened:
+            self.actionBar.playbackTimer.setTime(currentTime / 1000)
+        else:
+            self.actionBar.playbackTimer.setTime(0)
+            self.actionBar.playbackTimer.setDuration(0)
 
         # update last hover time if currently hovering
         if self.volumeBar.isHovering:
@@ -452,63 +692,20 @@ class VideoPlayer(tk.Frame):
         if self.actionBar.bVolume.isHovering:
             self.actionBar.bVolume.lastVolumeHover = time.time()
 
-        # update volume bar visibility
-        isHovering = self.volumeBar.isHovering or self.actionBar.bVolume.isHovering
+        # update volume bar visibility, only placed when it changes
         timeSinceLastVolChange = time.time() - self.lastVolumeChange
         timeSinceLastVolHover = time.time() - max(self.volumeBar.lastVolumeHover, self.actionBar.bVolume.lastVolumeHover)
+        isVisible = (timeSinceLastVolHover < 1 or timeSinceLastVolChange < 1) and not self.bFullscreen.isFullscreen
+        if isVisible != self.isVolumeBarVisible:
+            self.isVolumeBarVisible = isVisible
+            self.volumeBar.place(x=self.actionBar.bVolume.winfo_x() + (self.actionBar.bVolume.winfo_width()/2) - (self.volumeBar.width/2), y=self.canvas.winfo_height() - self.volumeBar.height - 5, width=self.volumeBar.width if isVisible else 0, height=self.volumeBar.height if isVisible else 0)
 
-        if (timeSinceLastVolHover < 1 or timeSinceLastVolChange < 1) and not self.bFullscreen.isFullscreen:
-            self.isVolumeBarVisible = True
-            self.volumeBar.place(x=self.actionBar.bVolume.winfo_x() + (self.actionBar.bVolume.winfo_width()/2) - (self.volumeBar.width/2), y=self.canvas.winfo_height() - self.volumeBar.height - 5, width=self.volumeBar.width, height=self.volumeBar.height)
-        else:   # hide
-            self.isVolumeBarVisible = False
-            self.volumeBar.place(x=self.actionBar.bVolume.winfo_x() + (self.actionBar.bVolume.winfo_width()/2) - (self.volumeBar.width/2), y=self.canvas.winfo_height() - self.volumeBar.height - 5, width=0, height=0)
-        
-
-        # update playback timer
-        if self.isVideoOpened and self.player.get_state() != vlc.State.Stopped:
-            if self.player.get_state() == vlc.State.Ended:
-                self.actionBar.playbackTimer.setTime(self.player.get_length() / 1000)
-            elif timeSinceLastEndState > self.timeToUpdateEndState or self.player.get_time() != 0:
-                self.actionBar.playbackTimer.setTime(self.player.get_time() / 1000)
-        else:
-            self.actionBar.playbackTimer.setTime(0)
-            self.actionBar.playbackTimer.setDuration(0)
-
-        # pause if in restricted mode and past boundary
-        # or replay in autoplay mode
-        if duration != 0:
-            if self.enableRestrictedPlayback and round(self.player.get_time(), 6) > round(self.restrictRight, 6): 
-                if self.clipScene.options["LoopPlayback"].get():
-                    if not self.progressBar.isClicking and not self.bPause.isPaused:
-                        self._setPlayerPosition(0)
-                else:
-                    if not self.bPause.isPaused: 
-                        self.bPause.togglePause() 
-                    
-                    
-                    if self.clipScene.framePerfectButton.isSet.get() == 1:
-                        # delay needed to process recent pause
-                        self.parent.after(50, lambda: self._setPlayerPosition(self.restrictRight / duration))    
-                    else:
-                        self._setPlayerPosition(self.restrictRight / duration)     
-
-        # update discord presence
-        if self.discordPresence is not None:
-            try:
-                self.discordPresence.updateStatus(details="Clipping videos", state=f"{min(self.clipScene.currentVideo, self.clipScene.totalVideos)} of {self.clipScene.totalVideos}") 
-            except:
-                self.discordPresence = None     # discord was likely closed
-
-        # update options
-        if self.clipScene != None:
-            self.clipScene.updateOptions()
-                   
         # Schedule the next update
+        interval = PLAYING_UPDATE_INTERVAL if self.isPlaying or self.isVolumeBarVisible or self.progressBar.isClicking else IDLE_UPDATE_INTERVAL
         if self.mainApp == None: 
-            self.after(10, self._update)
+            self.after(interval, self._update)
         elif str(self.mainApp.getSceneType()) == str(gui.Scene.SCENE_CLIPS):
-            self.after(10, self._update)
+            self.after(interval, self._update)
 
     def restrictPlayback(self, time1: int, time2: int):
         """
@@ -527,6 +724,8 @@ class VideoPlayer(tk.Frame):
         rightPercent = time2 / self.player.get_length()
         self.progressBar.canvas.coords(self.progressBar.restrictBar, int(leftPercent * self.progressBar.width), 0, int(rightPercent * self.progressBar.width), self.progressBar.height * (2 if self.progressBar.isHovering or self.progressBar.isClicking else 1))
         self.progressBar.canvas.itemconfig(self.progressBar.restrictBar, state="normal")
+        self.progressBar.drawnCoords = None     # redraw the bars on the next update
+        self.progressBar.updateKeyframes()      # preview the range a stream copy writes
 
     def unrestrictPlayback(self):
         """
@@ -539,9 +738,60 @@ class VideoPlayer(tk.Frame):
             self.clipScene.leftTime = self.restrictLeft
             self.clipScene.rightTime = self.restrictRight
         self.progressBar.canvas.itemconfig(self.progressBar.restrictBar, state="hidden")
+        self.progressBar.drawnCoords = None
+        self.progressBar.updateKeyframes()
         
 
 
+class MediaPreloader():
+    """
+        A small LRU of vlc media objects, parsed in the background by vlc, along with their probed metadata and previews
+    """
+    def __init__(self, instance, maxItems: int = PRELOADED_MEDIA):
+        self.instance = instance
+        self.maxItems = maxItems
+        self.media = OrderedDict()      # filepath: vlc.Media, most recently used last
+
+    def preload(self, filepath: str, playbackPath: str = None):
+        """
+            Parses the media of playbackPath (the file itself by default) and warms the caches of the file
+        """
+        if playbackPath == None: playbackPath = filepath
+        if playbackPath in self.media:
+            self.media.move_to_end(playbackPath)
+            return
+        if not os.path.exists(playbackPath): return
+
+        media = self.instance.media_new(playbackPath)
+        media.parse_with_options(vlc.MediaParseFlag.local, -1)     # asynchronous
+        self.media[playbackPath] = media
+        self._evict()
+
+        # warm the caches used once the video is open, the keyframe index reads the whole file so it is only built for neighbours
+        probe.prefetchMediaInfo([filepath])
+        thumbnails.getCachedSpriteSheet(filepath)
+        waveform.getCachedPeaks(filepath)
+        keyframeIndex.getCachedKeyframes(filepath)
+
+    def get(self, filepath: str):
+        """
+            Returns the media of the file, preloaded if possible
+        """
+        media = self.media.get(filepath)
+        if media == None:
+            media = self.instance.media_new(filepath)
+            self.media[filepath] = media
+        self.media.move_to_end(filepath)
+        self._evict()
+        return media
+
+    def _evict(self):
+        while len(self.media) > self.maxItems:
+            _, media = self.media.popitem(last=False)
+            media.release()     # the player keeps its own reference if it is still playing it
+
+
+
 class ActionBar(tk.Frame):
     """
         A frame of buttons used to control the video player
@@ -584,11 +834,15 @@ class PlaybackTimer(tk.Frame):
         
 
     def setTime(self, seconds: int):
-        self.time = self._convertTime(seconds)
+        time = self._convertTime(seconds)
+        if time == self.time: return
+        self.time = time
         self.text.config(text=self._getTimeText())
 
     def setDuration(self, seconds: int):
-        self.duration = self._convertTime(seconds)
+        duration = self._convertTime(seconds)
+        if duration == self.duration: return
+        self.duration = duration
         self.text.config(text=self._getTimeText())
 
     def _convertTime(self, seconds: int):
@@ -916,6 +1170,7 @@ class PauseButton(tk.Frame):
             self.bPause.config(image=self.playImage)
             self.isPaused = True
         else:
+            self.parent.parent.hideFrame()      # play from the stepped frame
             self.player.play()
             self.bPause.config(image=self.pauseImage)
             self.isPaused = False
@@ -926,6 +1181,7 @@ class PauseButton(tk.Frame):
         self.isPaused = True
 
     def setUnpaused(self):
+        self.parent.parent.hideFrame()
         self.player.play()
         self.bPause.config(image=self.pauseImage)
         self.isPaused = False
@@ -992,12 +1248,23 @@ class ProgressBar(tk.Frame):
         self.isHovering = False
         self.isClicking = False
         self.lastClick_PauseState = None
+        self.drawnCoords = None         # width and bar coordinates last drawn by setValue
+        self.waveformKey = None         # file, width and duration of the drawn waveform
+        self.lastWaveformCheck = 0
+        self.keyframeKey = None         # state the keyframe ticks and copy range were drawn for
+        self.lastKeyframeCheck = 0
+        self.thumbnailSheet = None
+        self.thumbnailIndex = None
+        self.thumbnailImage = None
 
         # instances
+        self.thumbnail = tk.Label(parent, bg="#000000", fg="#ffffff", compound="top", borderwidth=1, relief="solid", font=("Helvetica", 8))
         self.canvas = tk.Canvas(self, width=width, height=height, borderwidth=0, highlightthickness=0, bg=bg)
         self.backBar = self.canvas.create_rectangle(0, 0, self.width, self.height, fill=bg, width=0)
+        self.copyBar = self.canvas.create_rectangle(0, 0, 0, 0, outline='', fill="#2c3b52", state="hidden")     # range a stream copy actually writes
         self.restrictBar = self.canvas.create_rectangle(0, 0, self.width, self.height, outline='', fill="#3b5071", state="hidden")
         self.progressBar = self.canvas.create_rectangle(0, 0, 0, self.height, fill=fg, outline='')
+        self.waveform = self.canvas.create_polygon(0, 0, 0, 0, fill="#d0d0d0", stipple="gray50", outline="", state="hidden")     # over the bars, stippled so they show through
         
 
         # build
@@ -1011,9 +1278,11 @@ class ProgressBar(tk.Frame):
         self.canvas.bind("<Button-2>", self.onOtherClick)
         self.canvas.bind("<B1-Motion>", self.onDrag)
         self.canvas.bind("<ButtonRelease-1>", self.onUnclick)
+        self.canvas.bind("<Motion>", self.showThumbnail)
 
     def onDrag(self, event):
         if not self.isClicking: return
+        self.showThumbnail(event)
         x = event.x - self.canvas.canvasx(0)
         percent = x / self.width
         percent = max(0, percent)
@@ -1089,9 +1358,11 @@ class ProgressBar(tk.Frame):
         self.isHovering = True
         # update canvas size
         self.canvas.config(height=self.height*2)
+        self.showThumbnail(event)
 
     def onLeave(self, event):
         self.isHovering = False
+        self.hideThumbnail()
 
         if not self.isClicking:
             # update canvas size
@@ -1100,34 +1371,124 @@ class ProgressBar(tk.Frame):
         # call other update function
         self.parent.onLeave_ProgressBar(event=None)
 
+    def updateWaveform(self):
+        """
+            Draws the audio envelope of the open file once it is computed, and again when the bar is resized
+        """
+        key = (self.parent.filepath, self.width, self.parent.duration)
+        if key == self.waveformKey or time.time() - self.lastWaveformCheck < .5: return
+        self.lastWaveformCheck = time.time()
+
+        peaks = waveform.getCachedPeaks(self.parent.filepath) if self.parent.filepath != None else None
+        if peaks == None or self.width <= 0 or self.parent.duration <= 0:
+            self.canvas.itemconfig(self.waveform, state="hidden")
+            return
+
+        mins, maxs = peaks.getEnvelope(self.width, self.parent.duration / 1000)
+        scale = max(abs(mins.min()), abs(maxs.max()), 1e-4)        # quiet recordings fill the bar as well
+
+        # outline along the maximums, then back along the minimums
+        center = self.height
+        xs = np.arange(self.width)
+        top = np.stack([xs, center - maxs / scale * center], axis=1)
+        bottom = np.stack([xs[::-1], center - mins[::-1] / scale * center], axis=1)
+        self.canvas.coords(self.waveform, *np.concatenate([top, bottom]).ravel().tolist())
+        self.canvas.itemconfig(self.waveform, state="normal")
+        self.waveformKey = key
+
+    def updateKeyframes(self):
+        """
+            Draws a tick at every keyframe of the open file, and when a stream copied range is set, the range the copy will actually write
+        """
+        video = self.parent
+        framePerfectButton = getattr(video.clipScene, "framePerfectButton", None)     # not created yet while the scene is built
+        isFramePerfect = framePerfectButton != None and framePerfectButton.isSet.get() == 1
+        key = (video.filepath, self.width, video.duration, video.enableRestrictedPlayback, video.restrictLeft, video.restrictRight, isFramePerfect)
+        if key == self.keyframeKey or (self.keyframeKey == None and time.time() - self.lastKeyframeCheck < .5): return
+        self.lastKeyframeCheck = time.time()
+
+        keyframes = keyframeIndex.getCachedKeyframes(video.filepath) if video.filepath != None else None
+        self.canvas.delete("keyframe")
+        self.canvas.itemconfig(self.copyBar, state="hidden")
+        if keyframes == None or len(keyframes) == 0 or video.duration <= 0 or self.width <= 0:
+            self.keyframeKey = None
+            return
+        self.keyframeKey = key
+        duration = video.duration / 1000
+
+        # ticks, left out when they would be too dense to tell apart
+        columns = np.unique((np.frombuffer(keyframes, dtype=np.float64) / duration * self.width).astype(np.int64))
+        if len(columns) <= self.width / 3:
+            for x in columns.tolist():
+                self.canvas.create_line(x, 0, x, 2, fill="#cccccc", tags="keyframe")
+
+        # copy range, from the keyframe before the start to the keyframe after the end, padded as the copy is
+        if video.enableRestrictedPlayback and not isFramePerfect:
+            keyStartTime = keyframeIndex.getPreviousKeyframe(keyframes, video.restrictLeft / 1000) or 0
+            keyEndTime = keyframeIndex.getNextKeyframe(keyframes, video.restrictRight / 1000) or duration
+            leftPercent = max(0, keyStartTime - .1) / duration
+            rightPercent = min(duration, keyEndTime + .1) / duration
+            self.canvas.coords(self.copyBar, int(leftPercent * self.width), 0, int(rightPercent * self.width), self.height * 2)
+            self.canvas.itemconfig(self.copyBar, state="normal")
+
+    def showThumbnail(self, event):
+        """
+            Shows the preview nearest to the hovered time above the bar, without seeking the player
+        """
+        if self.parent.filepath == None or self.parent.duration <= 0: return
+        sheet = thumbnails.getCachedSpriteSheet(self.parent.filepath)
+        if sheet == None: return        # still being built
+
+        x = max(0, min(self.width, event.x - self.canvas.canvasx(0)))
+        seconds = x / self.width * self.parent.duration / 1000
+
+        # only create a new image when the nearest thumbnail changes
+        index = sheet.getIndex(seconds)
+        if sheet != self.thumbnailSheet or index != self.thumbnailIndex:
+            self.thumbnailImage = ImageTk.PhotoImage(sheet.getThumbnail(index))
+            self.thumbnailSheet = sheet
+            self.thumbnailIndex = index
+        self.thumbnail.config(image=self.thumbnailImage, text=f"{int(seconds // 3600)}:{int(seconds // 60 % 60):02}:{int(seconds % 60):02}" if seconds >= 3600 else f"{int(seconds // 60)}:{int(seconds % 60):02}")
+
+        # center over the cursor, kept within the player
+        width = sheet.tileWidth + 2
+        height = sheet.tileHeight + 18
+        self.thumbnail.place(x=max(0, min(self.width - width, x - width / 2)), y=max(0, self.winfo_y() - height - 4), width=width, height=height)
+        self.thumbnail.lift()
+
+    def hideThumbnail(self):
+        self.thumbnail.place_forget()
+
     def setValue(self, value: float):
         """
-            Sets progress bar value
+            Sets progress bar value, the canvas is only changed when a bar moves by a pixel
 
             Params:
             value: number between 0 and 1
         """
+        restrictBar = None
         if self.parent.enableRestrictedPlayback:
-            if self.player.get_length() == 0: return
-            leftTime = self.parent.restrictLeft
-            rightTime = self.parent.restrictRight
-            leftPercent = leftTime / self.player.get_length()
-            rightPercent = rightTime / self.player.get_length()
+            length = self.parent.playerLength
+            if length == 0: return
+            leftPercent = self.parent.restrictLeft / length
+            rightPercent = self.parent.restrictRight / length
 
-            self.canvas.coords(self.backBar, 0, 0, self.width, self.height * 2)
-            
             if value < leftPercent:
-                self.canvas.coords(self.progressBar, int(max(0, leftPercent) * self.width), 0, int(max(0, leftPercent) * self.width), self.height * 2)
+                progressBar = (int(max(0, leftPercent) * self.width), 0, int(max(0, leftPercent) * self.width), self.height * 2)
             else:
-                self.canvas.coords(self.progressBar, int(max(0, leftPercent) * self.width), 0, int(min(value, rightPercent) * self.width), self.height * 2)
-                
+                progressBar = (int(max(0, leftPercent) * self.width), 0, int(min(value, rightPercent) * self.width), self.height * 2)
+            restrictBar = (int(leftPercent * self.width), 0, int(rightPercent * self.width), self.height * 2)
         else:
-            self.canvas.coords(self.backBar, 0, 0, self.width, self.height * 2)
-            self.canvas.coords(self.progressBar, 0, 0, int(value * self.width), self.height * 2)
+            progressBar = (0, 0, int(value * self.width), self.height * 2)
 
-        # update restriction bar
-        if self.parent.enableRestrictedPlayback:
-            self.canvas.coords(self.restrictBar, int(leftPercent * self.width), 0, int(rightPercent * self.width), self.height * 2)
+        coords = (self.width, progressBar, restrictBar)
+        if coords == self.drawnCoords: return
+        self.drawnCoords = coords
+
+        self.canvas.coords(self.backBar, 0, 0, self.width, self.height * 2)
+        self.canvas.coords(self.progressBar, *progressBar)
+        if restrictBar != None:
+            self.canvas.coords(self.restrictBar, *restrictBar)
 
 
 
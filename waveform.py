@@ -0,0 +1,187 @@
+#
+# waveform.py
+#
+# Contains the audio waveform shown on the seek bar, stored per input file as a memory-mapped pyramid of min/max peaks
+#
+
+import os
+import json
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cache
+from cache import CREATION_FLAGS
+
+SAMPLE_RATE = 8000
+SAMPLES_PER_PEAK = 160          # 20ms of audio per peak of the finest level
+MIN_LEVEL_PEAKS = 256           # coarser levels are not built once a level is this small
+READ_PEAKS = 4096               # peaks decoded per read of the ffmpeg output
+
+# peaks loaded during this session
+_peaks = dict()
+_pending = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="waveform")
+
+
+class Peaks():
+    """
+        The min/max envelope of a file's audio at several resolutions, each level half the resolution of the one before.
+        Only the level needed by a drawing is read from the memory-mapped file
+    """
+    def __init__(self, path: str, peakDuration: float, levels: list):
+        self.data = np.memmap(path, dtype=np.float32, mode="r").reshape(-1, 2)
+        self.peakDuration = peakDuration
+        self.levels = levels        # list of [offset, count] within data
+
+    def getEnvelope(self, columns: int, duration: float):
+        """
+            Returns the (mins, maxs) arrays of the audio between 0 and duration (in seconds) reduced to the given number of columns.
+            Values are between -1 and 1, columns past the end of the audio are 0
+        """
+        mins = np.zeros(columns, dtype=np.float32)
+        maxs = np.zeros(columns, dtype=np.float32)
+        if columns <= 0 or duration <= 0: return mins, maxs
+
+        # coarsest level that still has a peak for every column
+        level = 0
+        while level + 1 < len(self.levels) and duration / (self.peakDuration * 2**(level+1)) >= columns:
+            level += 1
+        offset, count = self.levels[level]
+        span = duration / (self.peakDuration * 2**level)       # peaks of this level covering the duration
+        end = min(count, int(np.ceil(span)))
+        if end <= 0: return mins, maxs
+
+        levelData = self.data[offset:offset + end]
+        starts = (np.arange(columns) * span / columns).astype(np.int64)
+        valid = starts < end
+        if span >= columns:
+            mins[valid] = np.minimum.reduceat(levelData[:, 0], starts[valid])
+            maxs[valid] = np.maximum.reduceat(levelData[:, 1], starts[valid])
+        else:
+            mins[valid] = levelData[starts[valid], 0]      # fewer peaks than columns, repeat them
+            maxs[valid] = levelData[starts[valid], 1]
+
+        return mins, maxs
+
+
+
+def getCachedPeaks(inputPath: str):
+    """
+        Returns the peaks of the file if they are loaded, otherwise starts computing them in the background and returns None.
+        Never blocks, so it is safe to call from the GUI thread
+    """
+    try:
+        key = cache.getFileKey(inputPath)
+    except OSError:
+        return None
+
+    with _lock:
+        if key in _peaks: return _peaks[key]
+        if key in _pending: return None
+        _pending.add(key)
+
+    _executor.submit(_loadPeaks, inputPath, key)
+    return None
+
+def shutdown():
+    """
+        Cancels the waveforms that have not started computing yet
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+def _loadPeaks(inputPath: str, key: str):
+    try:
+        peaks = _readPeaks(key)
+        if peaks == None:
+            peaks = _buildPeaks(inputPath, key)
+    except Exception as e:
+        print(f"Could not create the waveform of [{inputPath}]: {e}")
+        peaks = None
+
+    with _lock:
+        _peaks[key] = peaks         # None is kept as well, so a file without audio is not retried
+        _pending.discard(key)
+
+def _readPeaks(key: str):
+    dataPath, metaPath = _getCachePaths(key)
+    if not os.path.exists(dataPath) or not os.path.exists(metaPath): return None
+
+    with open(metaPath, encoding="utf-8") as file:
+        meta = json.load(file)
+    return Peaks(dataPath, meta["peakDuration"], meta["levels"])
+
+def _buildPeaks(inputPath: str, key: str):
+    """
+        Streams the first audio track as mono PCM and writes the min/max of every SAMPLES_PER_PEAK samples,
+        then halves the resolution level by level from the previous level
+    """
+    dataPath, metaPath = _getCachePaths(key)
+    tempPath = f"{dataPath}.{os.getpid()}.tmp"
+
+    command = [
+        'ffmpeg', '-loglevel', 'quiet',
+        '-i', str(inputPath),
+        '-map', '0:a:0',                # first audio track
+        '-ac', '1',                     # downmix to mono
+        '-ar', str(SAMPLE_RATE),        # low sample rate, peaks are far coarser
+        '-f', 'f32le',                  # raw float samples
+        '-threads', '1',
+        '-'
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, creationflags=CREATION_FLAGS)
+
+    # finest level
+    count = 0
+    readSize = READ_PEAKS * SAMPLES_PER_PEAK * 4
+    remainder = b""
+    try:
+        with open(tempPath, "wb") as file:
+            while True:
+                chunk = process.stdout.read(readSize)
+                if not chunk: break
+                chunk = remainder + chunk
+
+                usable = len(chunk) - len(chunk) % (SAMPLES_PER_PEAK * 4)
+                remainder = chunk[usable:]
+                if usable == 0: continue
+
+                samples = np.frombuffer(chunk[:usable], dtype=np.float32).reshape(-1, SAMPLES_PER_PEAK)
+                np.stack([samples.min(axis=1), samples.max(axis=1)], axis=1).astype(np.float32).tofile(file)
+                count += samples.shape[0]
+
+            # partial final peak
+            if len(remainder) >= 4:
+                samples = np.frombuffer(remainder[:len(remainder) - len(remainder) % 4], dtype=np.float32)
+                np.array([[samples.min(), samples.max()]], dtype=np.float32).tofile(file)
+                count += 1
+    finally:
+        process.stdout.close()
+        process.wait()
+
+    if count == 0:
+        os.remove(tempPath)
+        raise Exception("no audio")
+
+    # coarser levels, each read from the level before it
+    levels = [[0, count]]
+    with open(tempPath, "ab") as file:
+        while levels[-1][1] > MIN_LEVEL_PEAKS:
+            offset, levelCount = levels[-1]
+            previous = np.fromfile(tempPath, dtype=np.float32, count=levelCount * 2, offset=offset * 8).reshape(-1, 2)
+            if levelCount % 2 == 1: previous = np.concatenate([previous, previous[-1:]])
+            pairs = previous.reshape(-1, 2, 2)
+            np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)], axis=1).astype(np.float32).tofile(file)
+            file.flush()
+            levels.append([offset + levelCount, pairs.shape[0]])
+
+    os.replace(tempPath, dataPath)
+    meta = dict(peakDuration=SAMPLES_PER_PEAK / SAMPLE_RATE, levels=levels)
+    cache.writeFileAtomic(metaPath, json.dumps(meta).encode("utf-8"))
+
+    return Peaks(dataPath, meta["peakDuration"], levels)
+
+def _getCachePaths(key: str):
+    directory = cache.getCacheDir("waveform")
+    return os.path.join(directory, f"{key}.peaks"), os.path.join(directory, f"{key}.json")